@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+import random
+from scheduler.parser import builtin_prelude
+from scheduler.target import NamedSpec
+
+CONSTANTS = [0, 1, 2, 4, 32, 64, 224]
+# left out: affect control flow or need many arguments to make sense
+EFFECT_AFFECTS = {'memory', 'storage', 'logs'}
+MAX_EFFECT_INPUTS = 4
+
+
+@dataclass
+class GeneratorOptions:
+    '''
+    `ops` calls per block, arguments are drawn from the `width` most recently defined values and
+    a call is one with side effects (`mstore`, `sstore`, `log*`, ...) with `effect_density`.
+    '''
+    ops: int = 16
+    width: int = 4
+    effect_density: float = 0.25
+    const_density: float = 0.1
+
+
+def _pools() -> tuple[list[NamedSpec], list[NamedSpec]]:
+    pure = []
+    effects = []
+    for d in builtin_prelude().defs:
+        spec = d.spec
+        if spec.inp.locals or spec.out.locals:
+            continue
+        if not spec.affects and len(spec.out.stack) == 1:
+            pure.append(d)
+        elif spec.affects and spec.affects <= EFFECT_AFFECTS and not spec.out.stack \
+                and len(spec.inp.stack) <= MAX_EFFECT_INPUTS:
+            effects.append(d)
+    return pure, effects
+
+
+def generate(options: GeneratorOptions, seed: int) -> str:
+    '''A random block in the `main [...]` DSL using the `EVM_EXT` definitions, same seed same block.'''
+    r = random.Random(seed)
+    pure, effects = _pools()
+    inputs = [f'i{i}' for i in range(options.width)]
+    defined = list(inputs)
+    used: set[str] = set()
+
+    def arg() -> str:
+        if r.random() < options.const_density:
+            return str(r.choice(CONSTANTS))
+        used.add(name := r.choice(defined[-options.width:]))
+        return name
+
+    lines = []
+    for i in range(options.ops):
+        d = r.choice(effects if r.random() < options.effect_density else pure)
+        call = f'{d.name}({", ".join(arg() for _ in d.spec.inp.stack)})'
+        if d.spec.out.stack:
+            defined.append(name := f'v{i}')
+            lines.append(f'{name} = {call}')
+        else:
+            lines.append(call)
+
+    # every value is consumed, unused ones (inputs included) are returned
+    out = [name for name in defined if name not in used]
+    return f'main [\n    in: [{", ".join(inputs)}]\n    out: [{", ".join(out)}]\n]\n\n' + '\n'.join(lines) + '\n'
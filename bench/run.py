@@ -0,0 +1,170 @@
+from typing import Any, Optional
+from dataclasses import asdict
+from itertools import chain
+from pathlib import Path
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from scheduler.parser import parse_to_target, builtin_prelude
+from scheduler.graph import Graph
+from scheduler.state import State
+from scheduler.symbolic import Config
+from scheduler.search import SearchProblem, astar
+from scheduler.anytime import beam_search
+from scheduler.heuristic import DEFAULT, HEURISTICS, prune_report
+from scheduler.cost import COST_MODELS
+from .generator import GeneratorOptions, generate
+
+CORPUS = Path(__file__).parent / 'corpus'
+PHASES = ['parse_ms', 'graph_ms', 'state_ms', 'search_ms']
+
+
+def _revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(source: str, args: argparse.Namespace) -> dict[str, Any]:
+    '''
+    Runs the pipeline `args.repeat` times and keeps the fastest time of every phase. Each run
+    builds a fresh `Graph`, so `State.from_graph` always includes building its template.
+    '''
+    config = Config(args.max_depth, args.max_depth)
+    times: dict[str, float] = {phase: float('inf') for phase in PHASES}
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        target = parse_to_target(source)
+        parsed = time.perf_counter()
+        graph = Graph(target)
+        graph.compact
+        built = time.perf_counter()
+        State.from_graph(graph, config)
+        instantiated = time.perf_counter()
+        problem = SearchProblem(graph, config, COST_MODELS[args.cost], por=args.por)
+        if args.strategy == 'astar':
+            schedule = astar(problem, DEFAULT, args.max_nodes)
+        else:
+            schedule = next(beam_search(problem, DEFAULT, args.beam_width), None)
+        done = time.perf_counter()
+        for phase, elapsed in zip(PHASES, (parsed - start, built - parsed, instantiated - built, done - instantiated)):
+            times[phase] = min(times[phase], elapsed * 1000)
+
+    record: dict[str, Any] = {
+        'calls': graph.total_fns - len(graph.consts),
+        'values': graph.total_values,
+        **{phase: round(ms, 3) for phase, ms in times.items()},
+    }
+    if schedule is not None:
+        record['cost'] = schedule.cost
+        record['optimal'] = schedule.optimal
+        record['expanded'] = schedule.expanded
+        record['expanded_per_s'] = round(schedule.expanded / max(times['search_ms'], 1e-3) * 1000)
+    else:
+        record['error'] = 'No schedule found'
+    return record
+
+
+def corpus(args: argparse.Namespace):
+    for path in sorted(Path(args.corpus).glob('*.evm')):
+        yield {'suite': 'corpus', 'name': path.stem, **measure(path.read_text(), args)}
+
+
+def heuristics(args: argparse.Namespace):
+    '''Expansions of A* with every estimator in `HEURISTICS` against `zero`, per corpus block.'''
+    config = Config(args.max_depth, args.max_depth)
+    for path in sorted(Path(args.corpus).glob('*.evm')):
+        problem = SearchProblem(Graph(parse_to_target(path.read_text())), config, COST_MODELS[args.cost], por=args.por)
+        for report in prune_report([problem], HEURISTICS, max_nodes=args.max_nodes):
+            record = asdict(report)
+            del record['problem']
+            pruned = report.pruned
+            yield {
+                'suite': 'heuristics',
+                'heuristic': record.pop('name'),
+                'name': path.stem,
+                **record,
+                'pruned': None if pruned is None else round(pruned, 4)
+            }
+
+
+def scaling(args: argparse.Namespace):
+    for ops in args.ops:
+        for seed in range(args.seeds):
+            options = GeneratorOptions(ops, args.width, args.effect_density)
+            yield {
+                'suite': 'random',
+                'name': f'ops{ops}-w{args.width}-e{args.effect_density}-s{seed}',
+                'ops': ops,
+                'width': args.width,
+                'effect_density': args.effect_density,
+                'seed': seed,
+                **measure(generate(options, seed), args)
+            }
+
+
+def summarize(records: list[dict[str, Any]]):
+    '''Median phase times per random block size on stderr.'''
+    sizes = sorted({record['ops'] for record in records if record['suite'] == 'random'})
+    for ops in sizes:
+        group = [record for record in records if record.get('ops') == ops]
+        medians = ', '.join(f'{phase} {statistics.median(r[phase] for r in group):.2f}' for phase in PHASES)
+        print(f'ops {ops:>4}: {medians}', file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Time parse, graph, state and search over a block corpus')
+    parser.add_argument(
+        '--suite', choices=['corpus', 'random', 'heuristics', 'all'], default='all',
+        help='all runs corpus and random, heuristics compares the estimators of `scheduler.heuristic`'
+    )
+    parser.add_argument('--corpus', default=str(CORPUS), help='directory of `.evm` blocks')
+    parser.add_argument('--ops', type=int, nargs='+', default=[2, 4, 6, 8], help='random block sizes in calls')
+    parser.add_argument('--seeds', type=int, default=3, help='random blocks per size')
+    parser.add_argument('--width', type=int, default=4, help='live values random calls draw arguments from')
+    parser.add_argument('--effect-density', type=float, default=0.25)
+    parser.add_argument('--repeat', type=int, default=1, help='runs per block, the fastest is reported')
+    parser.add_argument('--cost', choices=list(COST_MODELS), default='instructions')
+    parser.add_argument('--strategy', choices=['astar', 'beam'], default='astar')
+    parser.add_argument('--max-nodes', type=int, default=5_000)
+    parser.add_argument('--beam-width', type=int, default=64)
+    parser.add_argument('--max-depth', type=int, default=16)
+    parser.add_argument('--por', action='store_true', help='search with partial order reduction')
+    parser.add_argument('--out', default=None, help='JSONL file to write results to (default: stdout)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # keep the one-off prelude parse out of the first block's parse time
+    builtin_prelude()
+    out = sys.stdout if args.out is None else open(args.out, 'w')
+    header = {
+        'suite': 'meta',
+        'revision': _revision(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'options': {k: v for k, v in vars(args).items() if k != 'out'},
+    }
+    print(json.dumps(header), file=out, flush=True)
+
+    records = []
+    suites = [suite for name, suite in (('corpus', corpus), ('random', scaling)) if args.suite in (name, 'all')]
+    if args.suite == 'heuristics':
+        suites = [heuristics]
+    for record in chain.from_iterable(suite(args) for suite in suites):
+        records.append(record)
+        print(json.dumps(record), file=out, flush=True)
+    summarize(records)
+
+
+if __name__ == '__main__':
+    main()
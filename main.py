@@ -1,24 +1,200 @@
-from scheduler.parser import parse_to_target
+import argparse
+from contextlib import ExitStack, nullcontext
+import json
+import os
+import sys
+import time
+from scheduler.parser import BlockError, parse_to_target
 from scheduler.graph import Graph
-from scheduler.state import State, Config
+from scheduler.state import Config
+from scheduler.search import SearchProblem, astar
+from scheduler.anytime import anytime, deadline_from_ms
+from scheduler.bounded import ida_star, memory_bounded
+from scheduler.portfolio import portfolio
+from scheduler.batch import BatchOptions, compile_batch, read_blocks, read_directory, read_jsonl
+from scheduler.heuristic import DEFAULT
+from scheduler.cache import ScheduleCache
+from scheduler.cost import COST_MODELS
+from scheduler.partition import schedule_partitioned
+from scheduler.peephole import optimize
+from scheduler.stats import SearchStats
 
+# deepest DUP and SWAP the EVM has
+MAX_STACK_DEPTH = 16
+
+EXAMPLE = '''
+main [
+    in: [x, y]
+    out: [z]
+]
+
+sstore(y, sload(x))
+z = calldataload(4)
+'''
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Schedule a block into EVM stack ops')
+    parser.add_argument('source', nargs='?', help='block source file, `-` for stdin (default: built-in example)')
+    parser.add_argument(
+        '--batch', action='store_true',
+        help='treat source as a directory of blocks or a stream of blocks (see --format) '
+             'and write one JSON result per line'
+    )
+    parser.add_argument(
+        '--format', choices=['jsonl', 'dsl'], default='jsonl',
+        help='batch stream format: {"name", "source"} objects per line or concatenated blocks'
+    )
+    parser.add_argument('--cache', default=None, help='SQLite schedule cache to read from and write to')
+    parser.add_argument('--chunksize', type=int, default=16, help='blocks per worker task in batch mode')
+    parser.add_argument('--cost', choices=list(COST_MODELS), default='instructions', help='what a schedule minimizes')
+    parser.add_argument(
+        '--strategy', choices=['astar', 'idastar', 'bounded', 'beam', 'wastar', 'portfolio'], default='astar',
+        help='idastar and bounded trade search time for memory, see `scheduler.bounded`'
+    )
+    parser.add_argument('--deadline-ms', type=int, default=None, help='wall-clock budget for anytime strategies')
+    parser.add_argument('--beam-width', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes for portfolio and batch')
+    parser.add_argument('--max-nodes', type=int, default=100_000, help='node budget for astar (per segment with --partition)')
+    parser.add_argument('--max-frontier', type=int, default=100_000, help='open nodes kept by the bounded strategy')
+    parser.add_argument(
+        '--partition', type=int, default=None, metavar='MAX_CALLS',
+        help='schedule large blocks in segments of at most MAX_CALLS calls and stitch them together'
+    )
+    parser.add_argument('--max-depth', type=int, default=MAX_STACK_DEPTH, help='max DUP/SWAP depth')
+    parser.add_argument('--scratch-slots', type=int, default=0)
+    parser.add_argument('--peephole', action='store_true', help='clean up the found schedule with a peephole pass')
+    parser.add_argument('--reduce-edges', action='store_true', help='drop transitively implied effect edges first')
+    parser.add_argument(
+        '--por', action='store_true',
+        help='partial order reduction: run a ready call first where that keeps the schedule optimal'
+    )
+    parser.add_argument(
+        '--stats', default=None, metavar='FILE',
+        help='append search counters and phase timers to FILE as a JSON line (batch mode: add them to every result)'
+    )
+    parser.add_argument(
+        '--stats-sample', type=int, default=1, metavar='N',
+        help='time heuristics and sample the frontier every N expansions (see SearchStats)'
+    )
+    args = parser.parse_args()
+    if args.batch and args.strategy == 'portfolio':
+        parser.error('portfolio search is not supported in batch mode')
+    if not 1 <= args.max_depth <= MAX_STACK_DEPTH:
+        parser.error(f'--max-depth must be between 1 and {MAX_STACK_DEPTH} (DUP16/SWAP16)')
+    if args.chunksize < 1:
+        parser.error('--chunksize must be at least 1')
+    return args
 
-def main():
-    target = parse_to_target(
-        '''
-        main [
-            in: [x, y]
-            out: [z]
-        ]
 
-        sstore(y, sload(x))
-        z = calldataload(4)
-        '''
+def batch(args: argparse.Namespace):
+    options = BatchOptions(
+        config=Config(args.max_depth, args.max_depth, args.scratch_slots),
+        strategy=args.strategy,
+        cost=args.cost,
+        max_nodes=args.max_nodes,
+        max_frontier=args.max_frontier,
+        deadline_ms=args.deadline_ms,
+        beam_width=args.beam_width,
+        cache_path=args.cache,
+        reduce_edges=args.reduce_edges,
+        por=args.por,
+        partition=args.partition,
+        peephole=args.peephole,
+        stats_sample=args.stats_sample if args.stats else None
     )
+    read_stream = read_blocks if args.format == 'dsl' else read_jsonl
+    start = time.monotonic()
+    total = failed = 0
+    with ExitStack() as stack:
+        if args.source is None or args.source == '-':
+            blocks = read_stream(sys.stdin)
+        elif os.path.isdir(args.source):
+            blocks = read_directory(args.source)
+        else:
+            blocks = read_stream(stack.enter_context(open(args.source)))
+
+        try:
+            for result in compile_batch(blocks, options, args.workers, args.chunksize):
+                total += 1
+                failed += result.error is not None
+                print(json.dumps(result.to_json()), flush=True)
+        except BlockError as e:
+            sys.exit(f'{args.source}: {e}')
+    elapsed = time.monotonic() - start
+    print(f'{total} blocks, {failed} failed in {elapsed:.2f}s', file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    if args.batch:
+        return batch(args)
+    if args.source is None:
+        source = EXAMPLE
+    elif args.source == '-':
+        source = sys.stdin.read()
+    else:
+        with open(args.source) as f:
+            source = f.read()
+
+    stats = None if args.stats is None else SearchStats(args.stats_sample)
+
+    def phase(name: str):
+        return nullcontext() if stats is None else stats.timer(name)
+
+    with phase('parse'):
+        target = parse_to_target(source)
+    with phase('graph'):
+        g = Graph(target)
+        if args.reduce_edges:
+            g.transitive_reduction()
+    cost = COST_MODELS[args.cost]
+    problem = SearchProblem(g, Config(args.max_depth, args.max_depth, args.scratch_slots), cost, por=args.por)
+
+    cache = None if args.cache is None else ScheduleCache(args.cache)
+    with phase('search'):
+        if cache is not None and (schedule := cache.get(problem)) is not None and schedule.optimal:
+            print('cache hit', file=sys.stderr)
+        elif args.partition is not None:
+            schedule = schedule_partitioned(
+                g, problem.config, cost, args.partition, max_nodes=args.max_nodes, stats=stats
+            )
+        elif args.strategy == 'astar':
+            schedule = astar(problem, DEFAULT, args.max_nodes, stats=stats)
+        elif args.strategy == 'idastar':
+            schedule = ida_star(problem, DEFAULT, args.max_nodes, deadline_from_ms(args.deadline_ms), stats=stats)
+        elif args.strategy == 'bounded':
+            schedule = memory_bounded(
+                problem, DEFAULT, args.max_frontier,
+                max_nodes=args.max_nodes, deadline=deadline_from_ms(args.deadline_ms), stats=stats
+            )
+        elif args.strategy == 'portfolio':
+            schedule = portfolio(
+                g, problem.config,
+                deadline_ms=args.deadline_ms, max_workers=args.workers, reduce_edges=args.reduce_edges, cost=cost,
+                stats=stats
+            )
+        else:
+            start = time.monotonic()
+            schedule = None
+            for schedule in anytime(problem, DEFAULT, args.strategy, args.deadline_ms, args.beam_width, stats=stats):
+                elapsed_ms = (time.monotonic() - start) * 1000
+                print(f'[{elapsed_ms:.0f}ms] cost: {schedule.cost} (optimal: {schedule.optimal})', file=sys.stderr)
 
-    g = Graph(target)
-    s = State.from_graph(g, Config(16, 16))
-    print(s)
+    if schedule is None:
+        sys.exit('No schedule found')
+    with phase('emit'):
+        if args.peephole:
+            schedule = optimize(problem, schedule)
+        if cache is not None:
+            cache.put(problem, schedule)
+            cache.close()
+        print(f'cost: {schedule.cost} (optimal: {schedule.optimal})')
+        for instr in schedule.evm():
+            print(instr)
+    if stats is not None:
+        with open(args.stats, 'a') as f:
+            stats.write(f, source=args.source, strategy=args.strategy, cost=schedule.cost, optimal=schedule.optimal)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,179 @@
+from typing import Generator, Literal, Optional, TypeAlias
+from heapq import nsmallest
+from itertools import count
+import time
+from .state import State
+from .search import SearchProblem, Heuristic, Schedule, best_first
+from .table import Entry, TranspositionTable
+from .shared import SharedIncumbent
+from .stats import SearchStats
+
+
+Strategy: TypeAlias = Literal['beam', 'wastar']
+
+
+def deadline_from_ms(deadline_ms: Optional[int]) -> Optional[float]:
+    if deadline_ms is None:
+        return None
+    return time.monotonic() + deadline_ms / 1000
+
+
+def _expired(deadline: Optional[float], shared: Optional[SharedIncumbent] = None) -> bool:
+    if shared is not None and shared.stopped:
+        return True
+    return deadline is not None and time.monotonic() > deadline
+
+
+def beam_search(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    width: int = 64,
+    deadline: Optional[float] = None,
+    bound: Optional[int] = None,
+    shared: Optional[SharedIncumbent] = None,
+    stats: Optional[SearchStats] = None
+) -> Generator[Schedule, None, None]:
+    '''
+    Yields strictly improving schedules. Each pass keeps the `width` best states (by g + h) of
+    every depth layer; the width doubles after every pass. A pass that never had to cut a layer
+    was exhaustive, so its incumbent is yielded once more marked as optimal.
+    '''
+    if stats is not None:
+        heuristic = stats.timed(heuristic)
+    incumbent: Optional[Schedule] = None
+
+    while not _expired(deadline, shared):
+        tie = count()
+        best_g: dict[State, int] = {}
+        layer = [Entry(problem.initial(), 0)]
+        truncated = False
+        expanded = 0
+
+        while layer and not _expired(deadline, shared):
+            if shared is not None:
+                bound = shared.tighten(bound)
+            candidates = []
+            for entry in layer:
+                if problem.is_goal(entry.state):
+                    if bound is None or entry.g < bound:
+                        bound = entry.g
+                        incumbent = Schedule(entry.path(), entry.g, optimal=False, expanded=expanded)
+                        if stats is not None:
+                            stats.goal(len(incumbent.ops))
+                        yield incumbent
+                    continue
+                expanded += 1
+                if stats is not None:
+                    stats.expand(len(candidates))
+
+                for op, child in problem.successors(entry.state):
+                    child_g = entry.g + problem.cost(op)
+                    if best_g.get(child, child_g + 1) <= child_g:
+                        if stats is not None:
+                            stats.duplicates += 1
+                        continue
+                    best_g[child] = child_g
+                    child_h = heuristic(problem, child)
+                    if bound is not None and child_g + child_h >= bound:
+                        if stats is not None:
+                            stats.pruned += 1
+                        continue
+                    candidates.append((child_g + child_h, child_h, next(tie), entry.child(child, op, child_g)))
+                    if stats is not None:
+                        stats.generated += 1
+
+            truncated |= len(candidates) > width
+            layer = [entry for *_, entry in nsmallest(width, candidates)]
+
+        if layer:
+            return
+        if not truncated:
+            if incumbent is not None:
+                incumbent.optimal = True
+                yield incumbent
+            return
+        width *= 2
+
+
+def weighted_astar(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    weight: float = 3.0,
+    shrink: float = 0.5,
+    deadline: Optional[float] = None,
+    table_capacity: int = 1 << 20,
+    bound: Optional[int] = None,
+    shared: Optional[SharedIncumbent] = None,
+    stats: Optional[SearchStats] = None
+) -> Generator[Schedule, None, None]:
+    '''
+    Anytime repairing weighted A*: repeated best-first passes with f = g + weight * h, shrinking
+    `weight - 1` by `shrink` after every pass and pruning against the incumbent. A pass that
+    exhausts its frontier without a better schedule proves the incumbent optimal.
+    '''
+    incumbent: Optional[Schedule] = None
+
+    while not _expired(deadline, shared):
+        table = TranspositionTable(table_capacity)
+        schedule, frontier, _ = best_first(
+            problem, heuristic, table, weight,
+            bound=bound, deadline=deadline, shared=shared, stats=stats
+        )
+
+        if schedule is not None:
+            bound = schedule.cost if bound is None else min(bound, schedule.cost)
+            if incumbent is None or schedule.cost < incumbent.cost:
+                incumbent = schedule
+                yield schedule
+            elif schedule.optimal:
+                incumbent.optimal = True
+                yield incumbent
+            if schedule.optimal:
+                return
+        elif frontier:
+            return
+        else:
+            # nothing beats the incumbent: with bound pruning on the unweighted g + h an
+            # exhausted pass is a proof at any weight
+            if incumbent is not None:
+                incumbent.optimal = True
+                yield incumbent
+            return
+
+        weight = 1 + (weight - 1) * shrink
+        if weight < 1.05:
+            weight = 1.0
+
+
+def anytime(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    strategy: Strategy = 'beam',
+    deadline_ms: Optional[int] = None,
+    beam_width: int = 64,
+    weight: float = 3.0,
+    shared: Optional[SharedIncumbent] = None,
+    stats: Optional[SearchStats] = None
+) -> Generator[Schedule, None, None]:
+    deadline = deadline_from_ms(deadline_ms)
+    if strategy == 'beam':
+        yield from beam_search(problem, heuristic, beam_width, deadline, shared=shared, stats=stats)
+    elif strategy == 'wastar':
+        yield from weighted_astar(problem, heuristic, weight, deadline=deadline, shared=shared, stats=stats)
+    else:
+        raise ValueError(f'Unknown strategy {strategy!r}')
+
+
+def solve(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    strategy: Strategy = 'beam',
+    deadline_ms: Optional[int] = None,
+    beam_width: int = 64,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''Returns the best schedule found before `deadline_ms` runs out.'''
+    incumbent = None
+    for incumbent in anytime(problem, heuristic, strategy, deadline_ms, beam_width, stats=stats):
+        pass
+    return incumbent
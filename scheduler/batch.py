@@ -0,0 +1,254 @@
+from typing import Any, Generator, Iterable, Literal, Optional, TextIO, TypeAlias
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+import json
+import os
+import time
+from .parser import BlockError, builtin_prelude, extend_prelude, parse_prelude, parse_to_target, split_sources
+from .target import Prelude
+from .graph import Graph
+from .symbolic import Config
+from .search import SearchProblem, Schedule, astar
+from .heuristic import HEURISTICS
+from .anytime import solve, deadline_from_ms
+from .bounded import ida_star, memory_bounded
+from .cache import ScheduleCache
+from .cost import COST_MODELS
+from .partition import schedule_partitioned
+from .peephole import optimize
+from .stats import SearchStats
+
+
+BatchStrategy: TypeAlias = Literal['astar', 'idastar', 'bounded', 'beam', 'wastar']
+
+
+@dataclass
+class BlockSource:
+    name: str
+    source: str
+    # definitions added to the builtin prelude, see `read_blocks`
+    header: Optional[Prelude] = None
+
+
+@dataclass
+class BatchOptions:
+    config: Config = field(default_factory=lambda: Config(16, 16))
+    strategy: BatchStrategy = 'astar'
+    heuristic: str = 'default'
+    cost: str = 'instructions'
+    max_nodes: int = 100_000
+    max_frontier: int = 100_000
+    deadline_ms: Optional[int] = None
+    beam_width: int = 64
+    cache_path: Optional[str] = None
+    reduce_edges: bool = False
+    por: bool = False
+    # max calls per segment, see `partition`
+    partition: Optional[int] = None
+    peephole: bool = False
+    # record `SearchStats` sampled every this many expansions
+    stats_sample: Optional[int] = None
+
+
+@dataclass
+class BlockResult:
+    name: str
+    schedule: Optional[Schedule] = None
+    error: Optional[str] = None
+    parse_ms: float = 0.0
+    graph_ms: float = 0.0
+    search_ms: float = 0.0
+    cached: bool = False
+    stats: Optional[SearchStats] = None
+
+    def to_json(self) -> dict[str, Any]:
+        out: dict[str, Any] = {
+            'name': self.name,
+            'parse_ms': round(self.parse_ms, 3),
+            'graph_ms': round(self.graph_ms, 3),
+            'search_ms': round(self.search_ms, 3),
+            'cached': self.cached,
+        }
+        if self.schedule is not None:
+            out['cost'] = self.schedule.cost
+            out['optimal'] = self.schedule.optimal
+            out['ops'] = self.schedule.evm()
+        if self.error is not None:
+            out['error'] = self.error
+        if self.stats is not None:
+            out['stats'] = self.stats.to_json()
+        return out
+
+
+def read_directory(path: str | Path, pattern: str = '*') -> Generator[BlockSource, None, None]:
+    for file in sorted(Path(path).glob(pattern)):
+        if file.is_file():
+            yield BlockSource(file.name, file.read_text())
+
+
+def read_jsonl(stream: TextIO) -> Generator[BlockSource, None, None]:
+    '''Reads `{"name": ..., "source": ...}` objects, one per line. `name` defaults to the line number.'''
+    for i, line in enumerate(stream):
+        if not line.strip():
+            continue
+        obj = json.loads(line)
+        yield BlockSource(str(obj.get('name', i)), obj['source'])
+
+
+def read_blocks(lines: Iterable[str]) -> Generator[BlockSource, None, None]:
+    '''
+    Reads a multi-block DSL stream, see `split_sources`. Blocks are named by their starting line
+    and carry the `ext`/`sub` headers that precede them, each parsed once. Raises `BlockError`
+    for a malformed stream or header.
+    '''
+    header: Optional[Prelude] = None
+    for block in split_sources(lines):
+        if block.kind == 'main':
+            yield BlockSource(f'line {block.line}', block.source, header)
+            continue
+        try:
+            parsed = parse_prelude(block.source)
+            header = parsed if header is None else extend_prelude(header, parsed)
+        except Exception as e:
+            raise BlockError.in_block(block, e) from e
+
+
+_caches: dict[str, ScheduleCache] = {}
+
+
+def _cache(path: str) -> ScheduleCache:
+    # one connection per worker process
+    if (cache := _caches.get(path)) is None:
+        cache = _caches[path] = ScheduleCache(path)
+    return cache
+
+
+def compile_block(block: BlockSource, options: BatchOptions) -> BlockResult:
+    '''Schedules a single block, recording failures in the result instead of raising.'''
+    result = BlockResult(block.name)
+    if options.stats_sample is not None:
+        result.stats = SearchStats(options.stats_sample)
+    try:
+        start = time.perf_counter()
+        prelude = None if block.header is None else extend_prelude(builtin_prelude(), block.header)
+        target = parse_to_target(block.source, prelude)
+        parsed = time.perf_counter()
+        graph = Graph(target)
+        if options.reduce_edges:
+            graph.transitive_reduction()
+        built = time.perf_counter()
+        result.parse_ms = (parsed - start) * 1000
+        result.graph_ms = (built - parsed) * 1000
+
+        problem = SearchProblem(graph, options.config, COST_MODELS[options.cost], por=options.por)
+        cache = None if options.cache_path is None else _cache(options.cache_path)
+        if cache is not None and (cached := cache.get(problem)) is not None and cached.optimal:
+            result.schedule = cached
+            result.cached = True
+        else:
+            heuristic = HEURISTICS[options.heuristic]
+            if options.partition is not None:
+                result.schedule = schedule_partitioned(
+                    graph, options.config, COST_MODELS[options.cost], options.partition,
+                    max_nodes=options.max_nodes, stats=result.stats
+                )
+            elif options.strategy == 'astar':
+                result.schedule = astar(problem, heuristic, options.max_nodes, stats=result.stats)
+            elif options.strategy == 'idastar':
+                result.schedule = ida_star(
+                    problem, heuristic, options.max_nodes, deadline_from_ms(options.deadline_ms), stats=result.stats
+                )
+            elif options.strategy == 'bounded':
+                result.schedule = memory_bounded(
+                    problem, heuristic, options.max_frontier,
+                    max_nodes=options.max_nodes, deadline=deadline_from_ms(options.deadline_ms), stats=result.stats
+                )
+            else:
+                result.schedule = solve(
+                    problem, heuristic, options.strategy, options.deadline_ms, options.beam_width, result.stats
+                )
+            if options.peephole and result.schedule is not None:
+                result.schedule = optimize(problem, result.schedule)
+            if cache is not None and result.schedule is not None:
+                cache.put(problem, result.schedule)
+        result.search_ms = (time.perf_counter() - built) * 1000
+        if result.stats is not None:
+            result.stats.timers.update(parse=parsed - start, graph=built - parsed, search=result.search_ms / 1000)
+
+        if result.schedule is None:
+            result.error = 'No schedule found'
+    except Exception as e:
+        result.error = f'{e.__class__.__name__}: {e}'
+    return result
+
+
+def _compile_chunk(blocks: list[BlockSource], options: BatchOptions) -> list[BlockResult]:
+    return [compile_block(block, options) for block in blocks]
+
+
+def _isolated(block: BlockSource, options: BatchOptions) -> BlockResult:
+    '''Reruns `block` alone in a fresh worker, the block gets the error if that worker dies too.'''
+    with ProcessPoolExecutor(1) as pool:
+        try:
+            return pool.submit(compile_block, block, options).result()
+        except BrokenProcessPool as e:
+            return BlockResult(block.name, error=f'{e.__class__.__name__}: {e}')
+
+
+def _chunks(blocks: Iterable[BlockSource], size: int) -> Generator[list[BlockSource], None, None]:
+    iterator = iter(blocks)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def compile_batch(
+    blocks: Iterable[BlockSource],
+    options: Optional[BatchOptions] = None,
+    max_workers: Optional[int] = None,
+    chunksize: int = 16
+) -> Generator[BlockResult, None, None]:
+    '''
+    Schedules `blocks` on a process pool, yielding results in input order as they complete.
+    `blocks` is read lazily, at most two chunks of `chunksize` blocks per worker are in flight.
+    When a worker dies the pool is restarted and the blocks of the chunks it took down are rerun
+    one at a time, so only the block that crashes the worker gets an error result.
+    '''
+    assert chunksize > 0
+    if options is None:
+        options = BatchOptions()
+    workers = max_workers or os.cpu_count() or 1
+    chunks = _chunks(blocks, chunksize)
+    pool = ProcessPoolExecutor(workers)
+    pending: deque[tuple[list[BlockSource], Future, ProcessPoolExecutor]] = deque()
+    try:
+        while True:
+            while len(pending) < 2 * workers and (chunk := next(chunks, None)) is not None:
+                try:
+                    future = pool.submit(_compile_chunk, chunk, options)
+                except BrokenProcessPool:
+                    # a worker died since the last refill, its chunk fails when its turn comes
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(workers)
+                    future = pool.submit(_compile_chunk, chunk, options)
+                pending.append((chunk, future, pool))
+            if not pending:
+                return
+            chunk, future, submitted_to = pending.popleft()
+            try:
+                results = future.result()
+            except BrokenProcessPool:
+                if submitted_to is pool:
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(workers)
+                for block in chunk:
+                    yield _isolated(block, options)
+                continue
+            except Exception as e:
+                results = [BlockResult(block.name, error=f'{e.__class__.__name__}: {e}') for block in chunk]
+            yield from results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,278 @@
+from typing import Iterator, Optional
+from heapq import heapify, heappush, heappop, nsmallest
+from itertools import count
+import time
+from .search import SearchProblem, Heuristic, Schedule, Frontier, DEADLINE_CHECK_INTERVAL, _greedy
+from .table import Entry, TranspositionTable
+from .stats import SearchStats
+from .ops import Op
+
+# the frontier is never trimmed below this many times the widest expansion seen, below that
+# nearly every trim drops the children of the node just expanded and the search thrashes
+MIN_FRONTIER_PER_BRANCH = 8
+
+
+def _out_of_budget(expanded: int, max_nodes: Optional[int], deadline: Optional[float]) -> bool:
+    if max_nodes is not None and expanded >= max_nodes:
+        return True
+    return expanded % DEADLINE_CHECK_INTERVAL == 0 and deadline is not None and time.monotonic() > deadline
+
+
+def ida_star(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    max_nodes: Optional[int] = None,
+    deadline: Optional[float] = None,
+    cache_capacity: int = 1 << 16,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Iterative deepening A*: depth first passes that cut off at f = g + h above a threshold, which
+    starts at h of the initial state and grows to the smallest f cut off by the previous pass.
+    Ops are made and unmade on a single state, only the current path is kept, plus a
+    `cache_capacity` transposition table of the lowest g reached per state. The table is kept
+    across passes: a state reached at a higher g than any earlier pass reached it is skipped, one
+    reached at the same g is expanded once per pass (`Entry.closed` marks the current pass).
+
+    Once `max_nodes` expansions or `deadline` run out, the path to the node with the lowest h
+    (then g) is completed greedily as in `astar`, the result is not marked optimal.
+    '''
+    greedy_heuristic = heuristic
+    if stats is not None:
+        heuristic = stats.timed(heuristic)
+    state = problem.initial()
+    if problem.is_goal(state):
+        return Schedule([], 0, optimal=True)
+    threshold = heuristic(problem, state)
+    expanded = 0
+    table = TranspositionTable(cache_capacity)
+    promising: tuple[int, int, list[Op]] = (threshold, 0, [])
+
+    while True:
+        for entry in table:
+            entry.closed = False
+        table.put(Entry(state.copy(), 0, closed=True))
+        cutoff: Optional[int] = None
+        ops: list[Op] = []
+        marks: list[int] = []
+        path_g = [0]
+        path: list[Iterator[Op]] = [iter(problem.moves(state))]
+        expanded += 1
+
+        while path:
+            if (op := next(path[-1], None)) is None:
+                path.pop()
+                path_g.pop()
+                if ops:
+                    ops.pop()
+                    state.undo(marks.pop())
+                continue
+            g = path_g[-1] + problem.cost(op)
+            mark = state.mark()
+            made = problem.make(state, op)
+            assert made, f'Illegal move {op}'
+            if (known := table.get(state)) is not None and (known.g < g or known.g == g and known.closed):
+                state.undo(mark)
+                if stats is not None:
+                    stats.duplicates += 1
+                continue
+            if (f := g + heuristic(problem, state)) > threshold:
+                state.undo(mark)
+                cutoff = f if cutoff is None else min(cutoff, f)
+                if stats is not None:
+                    stats.pruned += 1
+                continue
+            if stats is not None:
+                stats.generated += 1
+            if problem.is_goal(state):
+                if stats is not None:
+                    stats.goal(len(ops) + 1)
+                return Schedule(ops + [op], g, optimal=True, expanded=expanded)
+            if (h := f - g, g) < promising[:2]:
+                promising = (h, g, ops + [op])
+            if _out_of_budget(expanded, max_nodes, deadline):
+                schedule = _complete(problem, greedy_heuristic, promising[2], stats)
+                if schedule is not None:
+                    schedule.expanded += expanded
+                return schedule
+            table.put(Entry(state.copy(), g, depth=len(ops) + 1, closed=True))
+            ops.append(op)
+            marks.append(mark)
+            path_g.append(g)
+            path.append(iter(problem.moves(state)))
+            expanded += 1
+            if stats is not None:
+                stats.expand(len(path))
+
+        if cutoff is None:
+            return None
+        threshold = cutoff
+
+
+def _complete(problem: SearchProblem, heuristic: Heuristic, ops: list[Op], stats: Optional[SearchStats]) -> Optional[Schedule]:
+    '''Greedy completion of the path `ops` from the initial state, uncapped as in `astar`.'''
+    entry = Entry(problem.initial(), 0)
+    for op in ops:
+        state = problem.apply(entry.state, op)
+        assert state is not None, f'Illegal move {op}'
+        entry = entry.child(state, op, entry.g + problem.cost(op))
+    return _greedy(problem, heuristic, entry, stats=stats)
+
+
+def _backup_target(problem: SearchProblem, table: TranspositionTable, forgotten: set[Entry], entry: Entry) -> Optional[Entry]:
+    '''
+    Nearest ancestor of the dropped `entry` still in memory, as the table knows it. None if a
+    cheaper path to that ancestor was found since, the dropped subtree is then dominated.
+    '''
+    target = entry.parent
+    while True:
+        assert target is not None
+        while target in forgotten:
+            target = target.parent
+            assert target is not None
+        if target.state is None:
+            target.state = problem.replay(target.path())  # type: ignore[assignment]
+        if (known := table.get(target.state)) is None or known is target:
+            return target
+        if known.g < target.g:
+            return None
+        target = known
+
+
+def _trim(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    frontier: Frontier,
+    keep: int,
+    table: TranspositionTable,
+    tie: count,
+    forgotten: set[Entry]
+) -> Frontier:
+    '''
+    Keeps the best item of the `keep` best open nodes, and of the root. Dropped nodes stay in the
+    table, closed and `forgotten`, so that other paths do not regenerate them, and the nearest
+    ancestor still in memory goes back on the frontier with the smallest f it lost.
+    '''
+    items: dict[int, tuple[float, int, int, Entry]] = {}
+    for item in frontier:
+        if not (entry := item[3]).closed and (id(entry) not in items or item < items[id(entry)]):
+            items[id(entry)] = item
+    best = {id(item[3]): item for item in nsmallest(keep, items.values())}
+    dropped = [item for key, item in items.items() if key not in best and item[3].parent is not None]
+    for *_, entry in dropped:
+        entry.closed = True
+        forgotten.add(entry)
+    backed_up: dict[int, tuple[float, Entry]] = {}
+    for f, _, _, entry in dropped:
+        if (target := _backup_target(problem, table, forgotten, entry)) is None:
+            continue
+        if (known := backed_up.get(id(target))) is None or f < known[0]:
+            backed_up[id(target)] = (f, target)
+    for key, item in items.items():
+        if key not in best and item[3].parent is None:
+            best[key] = item
+    for f, target in backed_up.values():
+        if id(target) not in best or f < best[id(target)][0]:
+            target.closed = False
+            best[id(target)] = (f, heuristic(problem, target.state), next(tie), target)
+    frontier = list(best.values())
+    heapify(frontier)
+    return frontier
+
+
+def memory_bounded(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    max_frontier: int = 100_000,
+    table_capacity: int = 1 << 18,
+    max_nodes: Optional[int] = None,
+    deadline: Optional[float] = None,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Memory bounded A* in the spirit of SMA*: once the frontier holds `max_frontier` nodes the
+    worse half is dropped and the ancestors of dropped nodes go back on the frontier with the
+    smallest f they lost, so the dropped subtrees are regenerated, from their parent only, when
+    they become the most promising again. The first goal is optimal, as with A*. The frontier
+    holds at least `MIN_FRONTIER_PER_BRANCH` times the widest expansion seen so far.
+
+    Once `max_nodes` expansions or `deadline` run out, the open node with the lowest h (then f)
+    is completed greedily as in `astar`, the result is not marked optimal.
+    '''
+    assert max_frontier >= 2
+    greedy_heuristic = heuristic
+    if stats is not None:
+        heuristic = stats.timed(heuristic)
+    table = TranspositionTable(table_capacity)
+    start = Entry(problem.initial(), 0)
+    table.put(start)
+    # newest first among equal (f, h), or regenerated children lose every tie and are dropped again
+    tie = count(0, -1)
+    h = heuristic(problem, start.state)
+    frontier: Frontier = [(h, h, next(tie), start)]
+    forgotten: set[Entry] = set()
+    expanded = width = 0
+
+    while frontier:
+        f, h, _, entry = heappop(frontier)
+        if entry.closed:
+            if stats is not None:
+                stats.stale += 1
+            continue
+        if (known := table.get(entry.state)) is None:
+            table.put(entry)
+        elif known is not entry:
+            if known.g <= entry.g:
+                if stats is not None:
+                    stats.stale += 1
+                continue
+            table.put(entry)
+
+        if problem.is_goal(entry.state):
+            schedule = Schedule(entry.path(), entry.g, optimal=True, expanded=expanded)
+            if stats is not None:
+                stats.goal(len(schedule.ops))
+            return schedule
+        if _out_of_budget(expanded, max_nodes, deadline):
+            _, _, _, promising = min(
+                (item for item in frontier + [(f, h, 0, entry)] if not item[3].closed),
+                key=lambda item: (item[1], item[0])
+            )
+            if (schedule := _greedy(problem, greedy_heuristic, promising, stats=stats)) is not None:
+                schedule.expanded += expanded
+            return schedule
+        entry.closed = True
+        expanded += 1
+        if stats is not None:
+            stats.expand(len(frontier))
+
+        children = 0
+        for op, child in problem.successors(entry.state):
+            child_g = entry.g + problem.cost(op)
+            if (known := table.get(child)) is not None and known.g <= child_g:
+                parent = known.parent
+                if known in forgotten and (
+                    parent is entry or parent is None or parent.state is None or table.get(parent.state) is not parent
+                ):
+                    # regenerated by its parent, or by another path once the parent is gone
+                    forgotten.discard(known)
+                    known.closed = False
+                    child_h = heuristic(problem, child)
+                    heappush(frontier, (max(f, known.g + child_h), child_h, next(tie), known))
+                    children += 1
+                elif stats is not None:
+                    stats.duplicates += 1
+                continue
+            child_h = heuristic(problem, child)
+            table.put(child_entry := entry.child(child, op, child_g))
+            # a child is never less promising than its parent was
+            heappush(frontier, (max(f, child_g + child_h), child_h, next(tie), child_entry))
+            children += 1
+            if stats is not None:
+                stats.generated += 1
+
+        width = max(width, children)
+        if len(frontier) >= (cap := max(max_frontier, MIN_FRONTIER_PER_BRANCH * width)):
+            frontier = _trim(problem, heuristic, frontier, cap // 2, table, tie, forgotten)
+
+    return None
@@ -0,0 +1,219 @@
+from typing import Any, Optional
+from hashlib import sha256
+import json
+import sqlite3
+from .graph import Const, FunctionNode, Graph
+from .target import DataLayout, FuncSpec
+from .search import SearchProblem, Schedule
+from .ops import Op, Swap, Dup, Pop, Push, Store, Load, Run, CostFn
+
+# Bump whenever the canonical form, the op encoding or the search semantics change.
+SCHEMA_VERSION = 1
+
+
+def _digest(*parts: Any) -> str:
+    return sha256(json.dumps(parts, separators=(',', ':')).encode()).hexdigest()
+
+
+def _layout_key(layout: DataLayout) -> list:
+    return [len(layout.stack), sorted(slot for _, slot in layout.locals)]
+
+
+def _spec_key(name: str, spec: FuncSpec) -> list:
+    return [name, _layout_key(spec.inp), _layout_key(spec.out), sorted(spec.deps), sorted(spec.affects)]
+
+
+def cost_version(cost: CostFn) -> Optional[str]:
+    '''
+    The `version` attribute of a cost function, which must change whenever its costs do. Problems
+    with an unversioned cost function are never cached.
+    '''
+    return getattr(cost, 'version', None)
+
+
+def canonical_order(graph: Graph) -> tuple[dict[int, str], dict[int, str], list[FunctionNode]]:
+    '''
+    Labels every value and function structurally, independent of variable names, statement order
+    and ids. Function labels cover the called spec, the labels of the inputs and of effect
+    predecessors, then get refined once with their consumers so that structurally identical calls
+    feeding different places are told apart. Returns the value labels (by vid), the function
+    labels (by fid) and the functions sorted by label.
+    '''
+    main_def = graph.target.main_def
+    value_labels: dict[int, str] = {}
+    for i, name in enumerate(main_def.inp.stack):
+        value_labels[graph.inputs[name].vid] = _digest('in', i)
+    for name, slot in main_def.inp.locals:
+        value_labels[graph.inputs[name].vid] = _digest('local', slot)
+    for value in graph.values:
+        if isinstance(value.producer, Const):
+            value_labels[value.vid] = _digest('const', value.producer.value)
+
+    up: dict[int, str] = {}
+    for fn in sorted(graph.fns, key=lambda fn: fn.fid):
+        # fids are handed out after a call's arguments, so fid order is topological
+        up[fn.fid] = _digest(
+            _spec_key(fn.calls, graph.specs[fn.calls].spec),
+            [value_labels[value.vid] for value in fn.inputs],
+            sorted(up[pred.fid] for pred in fn.preds)
+        )
+        for i, value in enumerate(fn.outputs):
+            value_labels[value.vid] = _digest(up[fn.fid], i)
+
+    outputs = _output_positions(graph)
+    labels = {
+        fn.fid: _digest(
+            up[fn.fid],
+            sorted(up[succ.fid] for succ in fn.succs),
+            [
+                sorted(
+                    [up[consumer.fid], [i for i, inp in enumerate(consumer.inputs) if inp is value]]
+                    for consumer in value.consumers
+                ) + [outputs.get(value.vid, [])]
+                for value in fn.outputs
+            ]
+        )
+        for fn in graph.fns
+    }
+    order = sorted(graph.fns, key=lambda fn: (labels[fn.fid], fn.fid))
+    return value_labels, labels, order
+
+
+def _output_positions(graph: Graph) -> dict[int, list]:
+    main_def = graph.target.main_def
+    positions: dict[int, list] = {}
+    for i, name in enumerate(main_def.out.stack):
+        positions.setdefault(graph.vars[name].vid, []).append(['out', i])
+    for name, slot in main_def.out.locals:
+        positions.setdefault(graph.vars[name].vid, []).append(['local', slot])
+    return positions
+
+
+def graph_key(problem: SearchProblem) -> Optional[tuple[str, list[FunctionNode]]]:
+    if (version := cost_version(problem.cost)) is None:
+        return None
+    graph = problem.graph
+    value_labels, labels, order = canonical_order(graph)
+    main_def = graph.target.main_def
+    config = problem.config
+    key = _digest(
+        SCHEMA_VERSION,
+        version,
+        [config.max_dup_depth, config.max_swap_depth, config.scratch_slots, problem.symmetry],
+        sorted(
+            [[sub.name, sub.params] for sub in group]
+            for group in graph.target.sub_groups
+        ),
+        _layout_key(main_def.inp),
+        [value_labels[graph.vars[name].vid] for name in main_def.out.stack],
+        sorted([slot, value_labels[graph.vars[name].vid]] for name, slot in main_def.out.locals),
+        [labels[fn.fid] for fn in order]
+    )
+    return key, order
+
+
+def _encode(op: Op, index: dict[int, int]) -> list:
+    if isinstance(op, Run):
+        return ['run', index[op.fid], op.name]
+    if isinstance(op, Swap):
+        return ['swap', op.depth]
+    if isinstance(op, Dup):
+        return ['dup', op.depth]
+    if isinstance(op, Pop):
+        return ['pop']
+    if isinstance(op, Push):
+        return ['push', hex(op.value)]
+    if isinstance(op, Store):
+        return ['store', op.slot]
+    if isinstance(op, Load):
+        return ['load', op.slot]
+    raise TypeError(f'Unknown op {op}')
+
+
+def _decode(item: list, order: list[FunctionNode]) -> Op:
+    kind, *args = item
+    if kind == 'run':
+        i, name = args
+        return Run(order[i].fid, name)
+    if kind == 'swap':
+        return Swap(args[0])
+    if kind == 'dup':
+        return Dup(args[0])
+    if kind == 'pop':
+        return Pop()
+    if kind == 'push':
+        return Push(int(args[0], 16))
+    if kind == 'store':
+        return Store(args[0])
+    if kind == 'load':
+        return Load(args[0])
+    raise ValueError(f'Unknown op kind {kind!r}')
+
+
+class ScheduleCache:
+    '''
+    Content-addressed SQLite store of schedules keyed by the canonical form of the problem (see
+    `graph_key`). Cached schedules are replayed against the requesting problem before use, a
+    schedule that does not reach the goal counts as a miss. Problems without a cost version always
+    miss and are never stored.
+    '''
+    path: str
+    conn: sqlite3.Connection
+    hits: int
+    misses: int
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS schedules ('
+            ' key TEXT PRIMARY KEY,'
+            ' ops TEXT NOT NULL,'
+            ' cost INTEGER NOT NULL,'
+            ' optimal INTEGER NOT NULL'
+            ')'
+        )
+        self.conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, problem: SearchProblem) -> Optional[Schedule]:
+        if (keyed := graph_key(problem)) is None:
+            self.misses += 1
+            return None
+        key, order = keyed
+        row = self.conn.execute('SELECT ops, optimal FROM schedules WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        ops_json, optimal = row
+        try:
+            ops = [_decode(item, order) for item in json.loads(ops_json)]
+        except (IndexError, ValueError):
+            ops = None
+        if ops is None or (final := problem.replay(ops)) is None or not problem.is_goal(final):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return Schedule(ops, sum(map(problem.cost, ops)), optimal=bool(optimal))
+
+    def put(self, problem: SearchProblem, schedule: Schedule):
+        '''Stores `schedule` unless an optimal or cheaper one is already cached.'''
+        if (keyed := graph_key(problem)) is None:
+            return
+        key, order = keyed
+        index = {fn.fid: i for i, fn in enumerate(order)}
+        ops = json.dumps([_encode(op, index) for op in schedule.ops], separators=(',', ':'))
+        with self.conn:
+            self.conn.execute(
+                'INSERT INTO schedules (key, ops, cost, optimal) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET ops = excluded.ops, cost = excluded.cost, optimal = excluded.optimal '
+                'WHERE NOT schedules.optimal AND (excluded.optimal OR excluded.cost < schedules.cost)',
+                (key, ops, schedule.cost, int(schedule.optimal))
+            )
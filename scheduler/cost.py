@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field, asdict
+from hashlib import sha256
+import json
+from .graph import Graph
+from .symbolic import Config
+from .ops import Op, CostFn
+
+MAX_PUSH_SIZE = 32
+
+# Static gas of every `ext` in `EVM_EXT`. Dynamic components (memory expansion, cold access,
+# copy sizes, ...) depend on runtime values and are not modelled.
+EXT_GAS: dict[str, int] = {
+    'stop': 0, 'add': 3, 'mul': 5, 'sub': 3, 'div': 5, 'sdiv': 5, 'mod': 5, 'smod': 5,
+    'addmod': 8, 'mulmod': 8, 'exp': 10,
+    'lt': 3, 'gt': 3, 'slt': 3, 'sgt': 3, 'eq': 3, 'iszero': 3,
+    'and': 3, 'or': 3, 'xor': 3, 'not': 3, 'byte': 3, 'shl': 3, 'shr': 3, 'sar': 3,
+    'sha3': 30,
+    'address': 2, 'balance': 100, 'origin': 2, 'caller': 2, 'callvalue': 2,
+    'calldataload': 3, 'calldatasize': 2, 'calldatacopy': 3, 'codesize': 2, 'codecopy': 3,
+    'gasprice': 2, 'extcodesize': 100, 'extcodecopy': 100, 'returndatasize': 2,
+    'returndatacopy': 3, 'extcodehash': 100,
+    'blockhash': 20, 'coinbase': 2, 'timestamp': 2, 'number': 2, 'difficulty': 2, 'gaslimit': 2,
+    'pop': 2, 'mload': 3, 'mstore': 3, 'mcopy': 3, 'mstore8': 3, 'sload': 100, 'sstore': 100,
+    'jump': 8, 'jumpi': 10, 'gas': 2, 'jumpdest': 1,
+    'log0': 375, 'log1': 750, 'log2': 1125, 'log3': 1500, 'log4': 1875,
+    'create': 32000, 'create2': 32000, 'call': 100, 'callcode': 100, 'delegatecall': 100,
+    'staticcall': 100, 'selfdestruct': 5000, 'revert': 0, 'invalid': 0, 'return': 0,
+}
+
+
+@dataclass
+class CostModel:
+    '''
+    Table driven cost of ops. `ext` costs are looked up by name once in `bind`, which returns a
+    `BoundCost` indexing flat per-kind tables by `Op.kind` and `Op.arg` (depth, push size or fid).
+    DUP and SWAP tables cover the depths allowed by the `Config` bound to.
+    '''
+    name: str
+    swap: int
+    dup: int
+    pop: int
+    push0: int
+    push_base: int
+    push_byte: int
+    mstore: int
+    mload: int
+    ext: dict[str, int]
+    ext_default: int
+
+    @property
+    def version(self) -> str:
+        '''Digest of the name and every cost, keys cached schedules (see `cache.cost_version`).'''
+        digest = sha256(json.dumps(asdict(self), sort_keys=True, separators=(',', ':')).encode())
+        return f'{self.name}-{digest.hexdigest()[:16]}'
+
+    def push(self, size: int) -> int:
+        return self.push0 if size == 0 else self.push_base + self.push_byte * size
+
+    def ext_cost(self, name: str) -> int:
+        return self.ext.get(name, self.ext_default)
+
+    def bind(self, graph: Graph, config: Config) -> 'BoundCost':
+        push = [self.push(size) for size in range(MAX_PUSH_SIZE + 1)]
+        run = [0] * graph.total_fns
+        for fn in graph.fns:
+            costs = {self.ext_cost(name) for name, _ in graph.call_variants(fn)}
+            # `Run` is costed by fid, so every variant of a call must cost the same
+            assert len(costs) == 1, f'Variants of {fn.calls!r} differ in cost: {costs}'
+            run[fn.fid], = costs
+        # ordered by op kind: SWAP, DUP, POP, PUSH, STORE, LOAD, RUN
+        return BoundCost(self.version, [
+            [self.swap] * (config.max_swap_depth + 1),
+            [self.dup] * (config.max_dup_depth + 1),
+            [self.pop],
+            push,
+            [cost + self.mstore for cost in push],
+            [cost + self.mload for cost in push],
+            run
+        ])
+
+
+@dataclass
+class BoundCost:
+    '''A `CostFn` for the graph it was bound to, indexed `tables[op.kind][op.arg]`.'''
+    version: str
+    tables: list[list[int]] = field(repr=False)
+
+    def __call__(self, op: Op) -> int:
+        return self.tables[op.kind][op.arg]
+
+
+# One per emitted instruction, the length of `Op.evm()`.
+INSTRUCTIONS = CostModel(
+    name='instructions',
+    swap=1, dup=1, pop=1,
+    push0=1, push_base=1, push_byte=0,
+    mstore=1, mload=1,
+    ext={}, ext_default=1
+)
+
+GAS = CostModel(
+    name='gas',
+    swap=3, dup=3, pop=2,
+    push0=2, push_base=3, push_byte=0,
+    mstore=3, mload=3,
+    ext=EXT_GAS, ext_default=0
+)
+
+# Every `ext` maps to a single one byte opcode.
+SIZE = CostModel(
+    name='size',
+    swap=1, dup=1, pop=1,
+    push0=1, push_base=1, push_byte=1,
+    mstore=1, mload=1,
+    ext={}, ext_default=1
+)
+
+COST_MODELS: dict[str, CostModel | CostFn] = {
+    'instructions': INSTRUCTIONS,
+    'gas': GAS,
+    'size': SIZE,
+}
@@ -1,6 +1,8 @@
-from typing import Optional
+from typing import Iterable, Optional
+from array import array
 from dataclasses import dataclass
 from collections import defaultdict
+from functools import cached_property
 from abc import ABC
 from .target import *
 
@@ -62,14 +64,117 @@ class ValueNode:
         return f'{self.__class__.__name__}(name={self.name!r}, producer={self.producer})'
 
 
+NO_PRODUCER = -1
+
+
+def _csr(rows: list[Iterable[int]]) -> tuple[array, array]:
+    offsets = array('I', [0])
+    items = array('H')
+    for row in rows:
+        items.extend(row)
+        offsets.append(len(items))
+    return offsets, items
+
+
+@dataclass(frozen=True, slots=True)
+class CompactGraph:
+    '''
+    Read-only, integer indexed view of a `Graph`. Adjacency is stored CSR style: the neighbours of
+    node `i` are `items[offsets[i]:offsets[i + 1]]`. Rows of fids that belong to constants are
+    empty. `producers` maps each vid to the fid of the call producing it, `NO_PRODUCER` for
+    inputs and constants. `output_counts` is how often each vid appears in the output layout of
+    `main`.
+    '''
+    total_fns: int
+    total_values: int
+    fids: array
+    calls: list[Optional[str]]
+    producers: array
+    output_counts: array
+    pred_offsets: array
+    preds: array
+    succ_offsets: array
+    succs: array
+    input_offsets: array
+    inputs: array
+    output_offsets: array
+    outputs: array
+    consumer_offsets: array
+    consumers: array
+
+    @classmethod
+    def build(cls, graph: 'Graph') -> 'CompactGraph':
+        fns: list[Optional[FunctionNode]] = [None] * graph.total_fns
+        for fn in graph.fns:
+            fns[fn.fid] = fn
+        values: list[ValueNode] = sorted(graph.values, key=lambda value: value.vid)
+
+        producers = array('h', [NO_PRODUCER]) * graph.total_values
+        for value in values:
+            if isinstance(value.producer, FunctionNode):
+                producers[value.vid] = value.producer.fid
+
+        output_counts = array('H', [0]) * graph.total_values
+        for name in graph.target.main_def.out.names():
+            output_counts[graph.vars[name].vid] += 1
+
+        pred_offsets, preds = _csr(sorted(p.fid for p in fn.preds) if fn else () for fn in fns)
+        succ_offsets, succs = _csr(sorted(s.fid for s in fn.succs) if fn else () for fn in fns)
+        input_offsets, inputs = _csr([v.vid for v in fn.inputs] if fn else () for fn in fns)
+        output_offsets, outputs = _csr([v.vid for v in fn.outputs] if fn else () for fn in fns)
+        consumer_offsets, consumers = _csr(sorted(c.fid for c in value.consumers) for value in values)
+
+        return cls(
+            total_fns=graph.total_fns,
+            total_values=graph.total_values,
+            fids=array('H', (fn.fid for fn in fns if fn is not None)),
+            calls=[fn.calls if fn else None for fn in fns],
+            producers=producers,
+            output_counts=output_counts,
+            pred_offsets=pred_offsets,
+            preds=preds,
+            succ_offsets=succ_offsets,
+            succs=succs,
+            input_offsets=input_offsets,
+            inputs=inputs,
+            output_offsets=output_offsets,
+            outputs=outputs,
+            consumer_offsets=consumer_offsets,
+            consumers=consumers
+        )
+
+    def fn_preds(self, fid: int) -> array:
+        return self.preds[self.pred_offsets[fid]:self.pred_offsets[fid + 1]]
+
+    def fn_succs(self, fid: int) -> array:
+        return self.succs[self.succ_offsets[fid]:self.succ_offsets[fid + 1]]
+
+    def fn_inputs(self, fid: int) -> array:
+        return self.inputs[self.input_offsets[fid]:self.input_offsets[fid + 1]]
+
+    def fn_outputs(self, fid: int) -> array:
+        return self.outputs[self.output_offsets[fid]:self.output_offsets[fid + 1]]
+
+    def value_consumers(self, vid: int) -> array:
+        return self.consumers[self.consumer_offsets[vid]:self.consumer_offsets[vid + 1]]
+
+
+@dataclass(frozen=True, slots=True)
+class Reachability:
+    '''Ancestor bitsets per fid over effect and data dependencies.'''
+    ancestors: list[int]
+
+
 class Graph:
     target: Target
     vars: dict[str, ValueNode]
     last_deps: dict[str,  set[FunctionNode]]
     last_affects: dict[str, FunctionNode]
     specs: dict[str, NamedSpec]
+    substitutions: dict[str, list[tuple[Substitution, list[Substitution]]]]
     fns: set[FunctionNode]
     values: set[ValueNode]
+    consts: dict[int, ValueNode]
     inputs: dict[str, ValueNode]
     total_fns: int
     total_values: int
@@ -83,12 +188,22 @@ class Graph:
         self.last_affects = {}
         self.fns = set()
         self.values = set()
+        self.consts = {}
 
         self.specs: dict[str, NamedSpec] = {
             d.name: d
             for d in target.defs
         }
 
+        self.substitutions = defaultdict(list)
+        for group in target.sub_groups:
+            for sub in group:
+                assert (named_spec := self.specs.get(sub.name)) is not None, \
+                    f'Substitution references unknown function {sub.name!r}'
+                assert sorted(sub.params) == list(range(named_spec.spec.inp.size())), \
+                    f'Substitution {sub.name}{tuple(sub.params)} is not a permutation of its inputs'
+                self.substitutions[sub.name].append((sub, group))
+
         self.inputs = {}
         for inp in target.main_def.inp.names():
             self.inputs[inp] = (node := self.value(inp, None))
@@ -120,8 +235,10 @@ class Graph:
 
     def _add_expr(self, expr: Expr) -> list[ValueNode]:
         if isinstance(expr, int):
-            const = Const(self._new_fid(), expr)
-            return [self.value(f'const:{expr}', const)]
+            if (value := self.consts.get(expr)) is None:
+                const = Const(self._new_fid(), expr)
+                value = self.consts[expr] = self.value(f'const:{expr}', const)
+            return [value]
 
         if isinstance(expr, str):
             assert (value := self.vars.get(expr)) is not None, \
@@ -168,6 +285,62 @@ class Graph:
 
         return outputs
 
+    def _parents(self, fn: FunctionNode) -> set[FunctionNode]:
+        return fn.preds | {
+            inp.producer
+            for inp in fn.inputs
+            if isinstance(inp.producer, FunctionNode)
+        }
+
+    @cached_property
+    def reachability(self) -> Reachability:
+        ancestors = [0] * self.total_fns
+        # fid order is topological
+        for fn in sorted(self.fns, key=lambda fn: fn.fid):
+            for parent in self._parents(fn):
+                ancestors[fn.fid] |= ancestors[parent.fid] | (1 << parent.fid)
+        return Reachability(ancestors)
+
+    def transitive_reduction(self) -> int:
+        '''
+        Drops effect edges implied by a longer path of effect or data dependencies, leaving the set
+        of valid schedules unchanged. Must run before `compact` is built, returns the number of
+        edges removed.
+        '''
+        assert 'compact' not in self.__dict__, 'Graph already frozen'
+        ancestors = self.reachability.ancestors
+        removed = 0
+        for fn in self.fns:
+            implied = 0
+            for parent in self._parents(fn):
+                implied |= ancestors[parent.fid]
+            for pred in [pred for pred in fn.preds if implied >> pred.fid & 1]:
+                fn.preds.remove(pred)
+                pred.succs.remove(fn)
+                removed += 1
+        return removed
+
+    @cached_property
+    def compact(self) -> CompactGraph:
+        '''Built on first access, the graph must not change afterwards.'''
+        return CompactGraph.build(self)
+
+    def call_variants(self, fn: FunctionNode) -> list[tuple[str, list[ValueNode]]]:
+        '''
+        Equivalent (function, inputs) pairs for `fn` according to the `sub` groups, starting with
+        the call as written.
+        '''
+        variants = [(fn.calls, fn.inputs)]
+        for sub, group in self.substitutions.get(fn.calls, []):
+            canonical: list[ValueNode] = [None] * len(fn.inputs)  # type: ignore
+            for inp, param in zip(fn.inputs, sub.params):
+                canonical[param] = inp
+            for other in group:
+                variant = (other.name, [canonical[param] for param in other.params])
+                if variant not in variants:
+                    variants.append(variant)
+        return variants
+
     def value(self, name: Optional[str], producer: Optional[Producer]) -> ValueNode:
         node = ValueNode(self._new_vid(), name, producer)
         self.values.add(node)
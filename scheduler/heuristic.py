@@ -1 +1,150 @@
-from .graph import Graph
+from typing import Generator, Optional
+from collections import Counter
+from dataclasses import dataclass
+from .graph import NO_PRODUCER
+from .state import State, DONE
+from .search import SearchProblem, Heuristic, best_first
+from .table import TranspositionTable
+
+# Every estimator below is admissible on its own. The ones combined by `sum_of` in `DEFAULT` each
+# bound the cost of a disjoint class of ops (calls, copies, drops, reorderings), so their sum is
+# admissible too.
+
+
+def zero(problem: SearchProblem, state: State) -> int:
+    return 0
+
+
+def remaining_calls(problem: SearchProblem, state: State) -> int:
+    '''Every function that has not run yet costs at least its own op.'''
+    pending = state.fn_pending_preds
+    return sum(
+        problem.fn_costs[fid]
+        for fid in problem.fids
+        if pending[fid] != DONE
+    )
+
+
+def _missing(problem: SearchProblem, state: State) -> Generator[tuple[int, int], None, None]:
+    on_stack = Counter(state.vm.stack)
+    pending = state.fn_pending_preds
+    producers = problem.compact.producers
+    for vid in range(problem.compact.total_values):
+        if (demand := problem.stack_demand(state, vid)) == 0:
+            continue
+        supply = on_stack[vid]
+        if (producer := producers[vid]) != NO_PRODUCER and pending[producer] != DONE:
+            supply += 1
+        if demand > supply:
+            yield vid, demand - supply
+
+
+def missing_copies(problem: SearchProblem, state: State) -> int:
+    '''
+    Every pending stack use of a value consumes one stack copy. Copies that neither exist yet nor
+    will be pushed by the value's producer have to be created by a DUP, PUSH or load.
+    '''
+    return sum(
+        problem.copy_costs[vid] * missing
+        for vid, missing in _missing(problem, state)
+    )
+
+
+def surplus_values(problem: SearchProblem, state: State) -> int:
+    '''
+    Stack height after the remaining calls and the minimum number of new copies, beyond the
+    height of the output layout, has to be removed by POPs or stores.
+    '''
+    pending = state.fn_pending_preds
+    height = len(state.vm.stack)
+    height += sum(
+        problem.stack_delta[fid]
+        for fid in problem.fids
+        if pending[fid] != DONE
+    )
+    height += sum(missing for _, missing in _missing(problem, state))
+    return max(0, height - len(problem.out_stack)) * problem.drop_cost
+
+
+def final_layout(problem: SearchProblem, state: State) -> int:
+    '''
+    Once all calls are done and the stack holds exactly the outputs, each SWAP (or any other op
+    that moves values) fixes at most two misplaced slots.
+    '''
+    pending = state.fn_pending_preds
+    if not all(pending[fid] == DONE for fid in problem.fids):
+        return 0
+    stack = state.vm.stack
+    if len(stack) != len(problem.out_stack):
+        return 0
+    if Counter(stack) != Counter(problem.out_stack):
+        return 0
+    misplaced = sum(a != b for a, b in zip(stack, problem.out_stack))
+    return (misplaced + 1) // 2 * problem.reorder_cost
+
+
+def sum_of(*heuristics: Heuristic) -> Heuristic:
+    def combined(problem: SearchProblem, state: State) -> int:
+        return sum(h(problem, state) for h in heuristics)
+    return combined
+
+
+DEFAULT = sum_of(remaining_calls, missing_copies, surplus_values, final_layout)
+
+HEURISTICS: dict[str, Heuristic] = {
+    'zero': zero,
+    'calls': remaining_calls,
+    'copies': missing_copies,
+    'surplus': surplus_values,
+    'layout': final_layout,
+    'default': DEFAULT,
+}
+
+
+@dataclass
+class PruneReport:
+    '''
+    A* expansions with one heuristic on one problem, `cost` is None if no goal was reached
+    within the node budget. Capped runs make `pruned` a lower bound when only the baseline
+    ran out and meaningless when both did.
+    '''
+    name: str
+    problem: int
+    estimate: int
+    expanded: int
+    cost: Optional[int]
+    baseline_expanded: int
+
+    @property
+    def pruned(self) -> Optional[float]:
+        '''Fraction of the baseline's expansions avoided by this heuristic.'''
+        if not self.baseline_expanded:
+            return None
+        return 1 - self.expanded / self.baseline_expanded
+
+
+def prune_report(
+    problems: list[SearchProblem],
+    heuristics: dict[str, Heuristic],
+    baseline: Heuristic = zero,
+    max_nodes: int = 100_000
+) -> list[PruneReport]:
+    '''
+    Runs A* on every problem with `baseline` and each of `heuristics`. Expansions are counted up
+    to the first goal, without the greedy completion `astar` adds once `max_nodes` run out.
+    '''
+    reports = []
+    for i, problem in enumerate(problems):
+        _, _, base_expanded = best_first(problem, baseline, TranspositionTable(), max_nodes=max_nodes)
+        start = problem.initial()
+        for name, heuristic in heuristics.items():
+            schedule, _, expanded = best_first(problem, heuristic, TranspositionTable(), max_nodes=max_nodes)
+            reports.append(PruneReport(
+                name=name,
+                problem=i,
+                estimate=heuristic(problem, start),
+                expanded=expanded,
+                cost=schedule.cost if schedule is not None else None,
+                baseline_expanded=base_expanded
+            ))
+    return reports
@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+from typing import Callable, ClassVar, TypeAlias
+
+
+WORD_SIZE = 0x20
+
+# Op kinds, `Op.kind` together with `Op.arg` indexes flat cost tables (see `cost.CostModel`).
+SWAP, DUP, POP, PUSH, STORE, LOAD, RUN = range(7)
+
+
+def push_size(value: int) -> int:
+    return (value.bit_length() + 7) // 8
+
+
+def push_evm(value: int) -> list[str]:
+    if value == 0:
+        return ['PUSH0']
+    return [f'PUSH{push_size(value)} {value:#x}']
+
+
+@dataclass(frozen=True)
+class Op:
+    kind: ClassVar[int]
+
+    @property
+    def arg(self) -> int:
+        return 0
+
+    def evm(self) -> list[str]:
+        raise NotImplementedError
+
+
+@dataclass(frozen=True)
+class Swap(Op):
+    kind = SWAP
+    depth: int
+
+    @property
+    def arg(self) -> int:
+        return self.depth
+
+    def evm(self) -> list[str]:
+        return [f'SWAP{self.depth}']
+
+
+@dataclass(frozen=True)
+class Dup(Op):
+    kind = DUP
+    depth: int
+
+    @property
+    def arg(self) -> int:
+        return self.depth
+
+    def evm(self) -> list[str]:
+        return [f'DUP{self.depth}']
+
+
+@dataclass(frozen=True)
+class Pop(Op):
+    kind = POP
+
+    def evm(self) -> list[str]:
+        return ['POP']
+
+
+@dataclass(frozen=True)
+class Push(Op):
+    kind = PUSH
+    value: int
+
+    @property
+    def arg(self) -> int:
+        return push_size(self.value)
+
+    def evm(self) -> list[str]:
+        return push_evm(self.value)
+
+
+@dataclass(frozen=True)
+class Store(Op):
+    kind = STORE
+    slot: int
+
+    @property
+    def arg(self) -> int:
+        return push_size(self.slot * WORD_SIZE)
+
+    def evm(self) -> list[str]:
+        return [*push_evm(self.slot * WORD_SIZE), 'MSTORE']
+
+
+@dataclass(frozen=True)
+class Load(Op):
+    kind = LOAD
+    slot: int
+
+    @property
+    def arg(self) -> int:
+        return push_size(self.slot * WORD_SIZE)
+
+    def evm(self) -> list[str]:
+        return [*push_evm(self.slot * WORD_SIZE), 'MLOAD']
+
+
+@dataclass(frozen=True)
+class Run(Op):
+    kind = RUN
+    fid: int
+    name: str
+
+    @property
+    def arg(self) -> int:
+        return self.fid
+
+    def evm(self) -> list[str]:
+        return [self.name.upper()]
+
+
+CostFn: TypeAlias = Callable[[Op], int]
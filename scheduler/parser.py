@@ -1,17 +1,30 @@
+from typing import Any, Generator, Iterable, Optional
+from dataclasses import dataclass
+from functools import cache
+from hashlib import sha256
+import os
+import pickle
+import re
 from lark import Lark, Transformer
 from .evm import EVM_EXT
 from .target import *
 
-PARSER = Lark(
-    '''
+# Optional path the parsed `EVM_EXT` prelude is pickled to, reused while the prelude is unchanged.
+PRELUDE_CACHE = os.environ.get('SCHEDULER_PRELUDE_CACHE') or None
+
+GRAMMAR = '''
     %import common.CNAME
     %import common.WS
     %import common.INT
 
     start: (ext_def | sub_group)* main
+    prelude: (ext_def | sub_group)*
 
     ext_def: "ext" CNAME "[" fn_def "]"
-    fn_def: deps? affects? "in:" data_layout "out:" data_layout
+    fn_def: deps? affects? _IN data_layout _OUT data_layout
+    // outrank CNAME so a layout's trailing locals don't swallow the next keyword
+    _IN.2: "in:"
+    _OUT.2: "out:"
 
     deps: "deps" "(" name_list? ")"
     affects: "affects" "(" name_list? ")"
@@ -39,33 +52,40 @@ PARSER = Lark(
     %ignore WS
     %ignore COMMENT
     '''
-)
 
 
 class EVMTransformer(Transformer):
+    '''
+    Applied inline by the LALR parser, rule callbacks receive raw tokens rather than transformed
+    terminals. `start` returns the block's own definitions, merged and validated in
+    `parse_to_target`.
+    '''
+
     def start(self, items):
-        defs = []
-        sub_groups = []
         main_def = None
         statements = []
-
         for item in items:
-            if isinstance(item, NamedSpec):
-                defs.append(item)
-            elif isinstance(item, list) and all(isinstance(x, Substitution) for x in item):
-                sub_groups.append(item)
-            elif isinstance(item, tuple) and len(item) == 2:
-                main_def, stmts = item
-                statements = stmts
-
+            if isinstance(item, tuple) and len(item) == 2:
+                main_def, statements = item
         assert main_def is not None
 
+        prelude = self.prelude(items)
         return Target(
-            defs=defs,
-            sub_groups=sub_groups,
+            defs=prelude.defs,
+            sub_groups=prelude.sub_groups,
             main_def=main_def,
             body=statements
-        ).validate()
+        )
+
+    def prelude(self, items):
+        defs = []
+        sub_groups = []
+        for item in items:
+            if isinstance(item, NamedSpec):
+                defs.append(item)
+            elif isinstance(item, list) and all(isinstance(x, Substitution) for x in item):
+                sub_groups.append(item)
+        return Prelude(defs, sub_groups)
 
     def ext_def(self, items):
         name, fn_def = items
@@ -111,7 +131,7 @@ class EVMTransformer(Transformer):
         if items and isinstance(items[0], list):
             stack = items[0]
 
-        for item in items[1:]:
+        for item in items:
             if isinstance(item, tuple):
                 name, index = item
                 assert isinstance(name, str)
@@ -124,6 +144,10 @@ class EVMTransformer(Transformer):
         name, index = items
         return (str(name), int(index))
 
+    def sub_group(self, items):
+        assert all(isinstance(item, Substitution) for item in items)
+        return list(items)
+
     def sub(self, items):
         name = str(items[0])
         params = [int(x) for x in items[1:]]
@@ -141,7 +165,7 @@ class EVMTransformer(Transformer):
     def call(self, items):
         name, *args = items
         assert all(isinstance(arg, Expr) for arg in args)
-        return Call(name=name, args=args)
+        return Call(name=str(name), args=args)
 
     def assign(self, items):
         return items[0]
@@ -156,22 +180,230 @@ class EVMTransformer(Transformer):
 
     def expr(self, items):
         item, = items
-        if isinstance(item, str) and item.isdigit():
-            return int(item)
+        if isinstance(item, str):
+            return int(item) if item.isdigit() else str(item)
         return item
 
     def name_list(self, items):
         return list(map(str, items))
 
-    def INT(self, token):
-        return int(token)
 
-    def CNAME(self, token):
-        return str(token)
+GRAMMAR_DIGEST = sha256(GRAMMAR.encode()).hexdigest()
+
+
+@cache
+def get_parser() -> Any:
+    '''
+    Builds the LALR(1) parser on first use. A standalone module generated with
+    `python -m scheduler.parser` is used instead when present and generated from this grammar.
+    '''
+    try:
+        from . import _standalone  # type: ignore
+        if _standalone.GRAMMAR_DIGEST == GRAMMAR_DIGEST:
+            return _standalone.Lark_StandAlone(transformer=EVMTransformer())
+    except ImportError:
+        pass
+    return _build_parser(EVMTransformer())
+
+
+def _build_parser(transformer: Optional[Transformer]) -> Lark:
+    return Lark(GRAMMAR, parser='lalr', start=['start', 'prelude'], transformer=transformer)
 
 
-def parse_to_target(input: str) -> Target:
-    tree = PARSER.parse(EVM_EXT + '\n' + input)
-    target = EVMTransformer().transform(tree)
-    assert isinstance(target, Target)
-    return target
+def parse_prelude(source: str) -> Prelude:
+    prelude = get_parser().parse(source, start='prelude')
+    assert isinstance(prelude, Prelude)
+    prelude.validate()
+    return prelude
+
+
+@cache
+def builtin_prelude() -> Prelude:
+    '''
+    The parsed `EVM_EXT` definitions, parsed once per process. With `PRELUDE_CACHE` set they are
+    loaded from / stored to that file, keyed by a digest of `EVM_EXT`.
+    '''
+    digest = sha256(EVM_EXT.encode()).hexdigest()
+    if PRELUDE_CACHE is not None:
+        try:
+            with open(PRELUDE_CACHE, 'rb') as f:
+                cached_digest, prelude = pickle.load(f)
+            if cached_digest == digest:
+                return prelude
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            pass
+
+    prelude = parse_prelude(EVM_EXT)
+    if PRELUDE_CACHE is not None:
+        tmp = f'{PRELUDE_CACHE}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((digest, prelude), f)
+        os.replace(tmp, PRELUDE_CACHE)
+    return prelude
+
+
+def extend_prelude(prelude: Prelude, header: Prelude) -> Prelude:
+    '''`prelude` followed by the definitions of `header`, both already validated.'''
+    names = {d.name for d in prelude.defs}
+    for d in header.defs:
+        if d.name in names:
+            raise ValueError(f'Duplicate function with name {d.name!r}')
+    return Prelude(prelude.defs + header.defs, prelude.sub_groups + header.sub_groups)
+
+
+def parse_to_target(input: str, prelude: Optional[Prelude] = None) -> Target:
+    '''
+    Parses a block on its own and merges it with `prelude`, by default the builtin `EVM_EXT`
+    definitions.
+    '''
+    block = get_parser().parse(input, start='start')
+    assert isinstance(block, Target)
+    if prelude is None:
+        prelude = builtin_prelude()
+    # the prelude was validated when parsed, only check what the block adds
+    block.validate()
+    if block.defs:
+        names = {d.name for d in prelude.defs}
+        for d in block.defs:
+            if d.name in names:
+                raise ValueError(f'Duplicate function with name {d.name!r}')
+    return Target(
+        defs=prelude.defs + block.defs,
+        sub_groups=prelude.sub_groups + block.sub_groups,
+        main_def=block.main_def,
+        body=block.body
+    )
+
+
+@dataclass
+class SourceBlock:
+    kind: str
+    source: str
+    offset: int
+    line: int
+    column: int
+
+
+@dataclass
+class ParsedBlock:
+    target: Target
+    offset: int
+    line: int
+    column: int
+
+
+class BlockError(ValueError):
+    '''An error at character `offset`, `line` and `column` (both 1-based) of a multi-block stream.'''
+    offset: int
+    line: int
+    column: int
+
+    def __init__(self, message: str, offset: int, line: int, column: int) -> None:
+        self.offset = offset
+        self.line = line
+        self.column = column
+        super().__init__(f'line {line}, column {column}: {message}')
+
+    @classmethod
+    def in_block(cls, block: SourceBlock, error: Exception) -> 'BlockError':
+        '''Locates `error` raised for `block`, lark reports positions relative to the block.'''
+        message = f'{error.__class__.__name__}: {error}'
+        line, column, pos = (getattr(error, attr, None) for attr in ('line', 'column', 'pos_in_stream'))
+        if not (isinstance(line, int) and line > 0 and isinstance(column, int) and column > 0):
+            return cls(message, block.offset, block.line, block.column)
+        if line == 1:
+            column += block.column - 1
+        offset = block.offset + pos if isinstance(pos, int) and pos >= 0 else block.offset
+        return cls(message, offset, block.line + line - 1, column)
+
+
+_TOKEN = re.compile(r'//[^\n]*|[A-Za-z_]\w*|\S')
+
+# token, offset, line, column
+Token = tuple[str, int, int, int]
+
+
+def _item_start(prev: list[Token]) -> Optional[Token]:
+    # `ext NAME [` first: ext names such as `sub` or `main` are keywords elsewhere
+    if len(prev) == 2 and prev[0][0] == 'ext':
+        return prev[0]
+    if prev and prev[-1][0] in ('main', 'sub'):
+        return prev[-1]
+    return None
+
+
+def split_sources(lines: Iterable[str]) -> Generator[SourceBlock, None, None]:
+    '''
+    Splits a stream holding any number of `ext`, `sub` and `main` items into one `SourceBlock`
+    per item without parsing them, only buffering the current item. Statements never contain
+    `[`, so every top-level `[` opens a new item whose keyword precedes it.
+    '''
+    buf: list[str] = []
+    buf_offset = 0
+    current: Optional[Token] = None
+    prev: list[Token] = []
+    depth = 0
+    offset = 0
+    for lineno, line in enumerate(lines, 1):
+        buf.append(line)
+        for m in _TOKEN.finditer(line):
+            if (token := m.group()).startswith('//'):
+                continue
+            if token == '[':
+                if depth == 0:
+                    if (start := _item_start(prev)) is None:
+                        raise BlockError("unexpected '['", offset + m.start(), lineno, m.start() + 1)
+                    text = ''.join(buf)
+                    head = text[:start[1] - buf_offset]
+                    if current is not None:
+                        yield SourceBlock(current[0], head, *current[1:])
+                    elif (junk := next((t for t in _TOKEN.finditer(head) if not t.group().startswith('//')), None)):
+                        pos = junk.start()
+                        raise BlockError(
+                            f'expected `ext`, `sub` or `main`, got {junk.group()!r}',
+                            pos, head.count('\n', 0, pos) + 1, pos - head.rfind('\n', 0, pos)
+                        )
+                    buf = [text[start[1] - buf_offset:]]
+                    buf_offset = start[1]
+                    current = start
+                depth += 1
+            elif token == ']':
+                depth -= 1
+                if depth < 0:
+                    raise BlockError("unbalanced ']'", offset + m.start(), lineno, m.start() + 1)
+            prev = [*prev[-1:], (token, offset + m.start(), lineno, m.start() + 1)]
+        offset += len(line)
+
+    if current is not None:
+        yield SourceBlock(current[0], ''.join(buf), *current[1:])
+
+
+def parse_blocks(lines: Iterable[str], prelude: Optional[Prelude] = None) -> Generator[ParsedBlock, None, None]:
+    '''
+    Parses a multi-block stream (e.g. an open file) lazily, yielding a target per `main` block.
+    `ext` and `sub` headers extend the definitions for every block after them.
+    '''
+    if prelude is None:
+        prelude = builtin_prelude()
+    for block in split_sources(lines):
+        try:
+            if block.kind != 'main':
+                prelude = extend_prelude(prelude, parse_prelude(block.source))
+                continue
+            target = parse_to_target(block.source, prelude)
+        except Exception as e:
+            raise BlockError.in_block(block, e) from e
+        yield ParsedBlock(target, block.offset, block.line, block.column)
+
+
+def generate_standalone(path: str):
+    '''Writes a standalone parser module for `GRAMMAR` that does not need to compile the grammar on import.'''
+    from lark.tools.standalone import gen_standalone
+    with open(path, 'w') as f:
+        gen_standalone(_build_parser(None), out=f)
+        f.write(f'\nGRAMMAR_DIGEST = {GRAMMAR_DIGEST!r}\n')
+
+
+if __name__ == '__main__':
+    import sys
+    generate_standalone(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '_standalone.py'))
@@ -0,0 +1,272 @@
+from typing import Callable, Optional, TypeAlias
+from dataclasses import dataclass
+from .target import *
+from .graph import Graph
+from .symbolic import Config
+from .search import SearchProblem, Schedule, astar
+from .heuristic import DEFAULT
+from .anytime import beam_search
+from .cost import CostModel, INSTRUCTIONS
+from .ops import Op, Run, CostFn
+from .stats import SearchStats
+
+
+SegmentSolver: TypeAlias = Callable[[SearchProblem, Optional[SearchStats]], Optional[Schedule]]
+
+
+def _expr_calls(expr: Expr) -> int:
+    if isinstance(expr, Call):
+        return 1 + sum(map(_expr_calls, expr.args))
+    return 0
+
+
+def _expr_uses(expr: Expr) -> set[str]:
+    if isinstance(expr, str):
+        return {expr}
+    if isinstance(expr, Call):
+        return set().union(*map(_expr_uses, expr.args))
+    return set()
+
+
+def _stmt_expr(stmt: Statement) -> Expr:
+    if isinstance(stmt, SingleAssign):
+        return stmt.expr
+    if isinstance(stmt, MultiAssign):
+        return stmt.call
+    return stmt
+
+
+def _stmt_defs(stmt: Statement) -> list[str]:
+    if isinstance(stmt, SingleAssign):
+        return [stmt.to]
+    if isinstance(stmt, MultiAssign):
+        return stmt.to
+    return []
+
+
+def _rename_expr(expr: Expr, names: dict[str, str]) -> Expr:
+    if isinstance(expr, str):
+        return names[expr]
+    if isinstance(expr, Call):
+        return Call(expr.name, [_rename_expr(arg, names) for arg in expr.args])
+    return expr
+
+
+def _to_ssa(target: Target) -> tuple[list[Statement], list[str], list[tuple[str, int]]]:
+    '''
+    Renames reassigned variables apart and resolves aliases, returns the body and the renamed
+    output layout.
+    '''
+    names = {name: name for name in target.main_def.inp.names()}
+    versions: dict[str, int] = {}
+    body: list[Statement] = []
+    for stmt in target.body:
+        expr = _rename_expr(_stmt_expr(stmt), names)
+        if isinstance(stmt, SingleAssign) and isinstance(expr, str):
+            # aliases would hand the same value over twice at a cut
+            names[stmt.to] = expr
+            continue
+        defs = []
+        for name in _stmt_defs(stmt):
+            versions[name] = versions.get(name, 0) + 1
+            names[name] = new = name if name not in names else f'{name}.{versions[name]}'
+            defs.append(new)
+        if isinstance(stmt, SingleAssign):
+            body.append(SingleAssign(defs[0], expr))
+        elif isinstance(stmt, MultiAssign):
+            assert isinstance(expr, Call)
+            body.append(MultiAssign(defs, expr))
+        else:
+            assert isinstance(expr, Call)
+            body.append(expr)
+    out = target.main_def.out
+    return body, [names[name] for name in out.stack], [(names[name], slot) for name, slot in out.locals]
+
+
+@dataclass
+class Segment:
+    '''Statements `body[start:stop]` scheduled from layout `inp` to layout `out`.'''
+    start: int
+    stop: int
+    inp: DataLayout
+    out: DataLayout
+
+
+@dataclass
+class Partition:
+    target: Target
+    body: list[Statement]
+    segments: list[Segment]
+    stmt_calls: list[int]
+
+    def sub_target(self, start: int, stop: int) -> Target:
+        first = next(s for s in self.segments if s.start == start)
+        last = next(s for s in self.segments if s.stop == stop)
+        return Target(
+            defs=self.target.defs,
+            sub_groups=self.target.sub_groups,
+            main_def=FuncSpec(first.inp, last.out, set(), set()),
+            body=self.body[start:stop]
+        )
+
+
+def partition(target: Target, max_calls: int = 12) -> Partition:
+    '''
+    Splits the body into segments of at most `max_calls` calls (a single larger statement gets a
+    segment of its own). Each cut is placed where the fewest live values cross, preferring cuts
+    right after calls with side effects. Values live across a cut are handed over on the stack
+    ordered by next use (soonest on top); live input locals stay in their slots.
+    '''
+    main_def = target.main_def
+    body, out_stack, out_locals = _to_ssa(target)
+    specs = {d.name: d.spec for d in target.defs}
+    n = len(body)
+
+    stmt_calls = [_expr_calls(_stmt_expr(stmt)) for stmt in body]
+    uses = [_expr_uses(_stmt_expr(stmt)) for stmt in body]
+    effects = [
+        isinstance(expr := _stmt_expr(stmt), Call) and bool(specs[expr.name].affects)
+        for stmt in body
+    ]
+    defined_at = {name: -1 for name in main_def.inp.names()}
+    for i, stmt in enumerate(body):
+        for name in _stmt_defs(stmt):
+            defined_at[name] = i
+    use_sites: dict[str, list[int]] = {name: [] for name in defined_at}
+    for i, names in enumerate(uses):
+        for name in sorted(names):
+            use_sites[name].append(i)
+    for name, _ in [(name, None) for name in out_stack] + out_locals:
+        use_sites[name].append(n)
+
+    def live(cut: int) -> list[str]:
+        return [
+            name
+            for name, at in defined_at.items()
+            if at < cut and use_sites[name] and use_sites[name][-1] >= cut
+        ]
+
+    def next_use(name: str, cut: int) -> int:
+        return next(i for i in use_sites[name] if i >= cut)
+
+    cuts = [0]
+    start = 0
+    if n == 0:
+        cuts.append(0)
+    while start < n:
+        calls = 0
+        candidates: list[int] = []
+        stop = start
+        while stop < n and (calls == 0 or calls + stmt_calls[stop] <= max_calls):
+            calls += stmt_calls[stop]
+            stop += 1
+            if calls > 0:
+                candidates.append(stop)
+        if stop >= n:
+            cuts.append(n)
+            break
+        cut = min(candidates, key=lambda cut: (len(live(cut)), not effects[cut - 1], -cut))
+        cuts.append(cut)
+        start = cut
+
+    inp_locals = dict(main_def.inp.locals)
+    layouts = [main_def.inp]
+    for cut in cuts[1:-1]:
+        names = live(cut)
+        stack = sorted(
+            (name for name in names if name not in inp_locals),
+            key=lambda name: (-next_use(name, cut), defined_at[name])
+        )
+        layouts.append(DataLayout(stack, [(name, inp_locals[name]) for name in names if name in inp_locals]))
+    layouts.append(DataLayout(out_stack, out_locals))
+
+    segments = [
+        Segment(start, stop, inp, out)
+        for start, stop, inp, out in zip(cuts, cuts[1:], layouts, layouts[1:])
+    ]
+    return Partition(target, body, segments, stmt_calls)
+
+
+def exact_or_beam(max_nodes: int = 20_000, beam_width: int = 64) -> SegmentSolver:
+    '''A* within `max_nodes` expansions, falling back to the first schedule of a beam search.'''
+    def solve(problem: SearchProblem, stats: Optional[SearchStats] = None) -> Optional[Schedule]:
+        if (schedule := astar(problem, DEFAULT, max_nodes, stats=stats)) is not None:
+            return schedule
+        return next(beam_search(problem, DEFAULT, beam_width, stats=stats), None)
+    return solve
+
+
+def _solve(
+    part: Partition,
+    start: int,
+    stop: int,
+    config: Config,
+    cost: CostModel | CostFn,
+    solve: SegmentSolver,
+    stats: Optional[SearchStats]
+) -> Optional[Schedule]:
+    return solve(SearchProblem(Graph(part.sub_target(start, stop)), config, cost), stats)
+
+
+def _remap(ops: list[Op], fids: list[int]) -> list[Op]:
+    # a segment creates its calls in the same order as the full graph, so the i-th call fid of
+    # the segment maps to the i-th call fid of the block within that segment
+    order = {fid: i for i, fid in enumerate(sorted({op.fid for op in ops if isinstance(op, Run)}))}
+    return [Run(fids[order[op.fid]], op.name) if isinstance(op, Run) else op for op in ops]
+
+
+def schedule_partitioned(
+    graph: Graph,
+    config: Config,
+    cost: CostModel | CostFn = INSTRUCTIONS,
+    max_calls: int = 12,
+    solve: Optional[SegmentSolver] = None,
+    improve_seams: bool = True,
+    max_nodes: int = 20_000,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Schedules each segment of `partition` separately and concatenates the results, the segment
+    layouts line up at every cut. With `improve_seams` adjacent segment pairs are re-solved as
+    one and replace both halves when that is cheaper. The result is replayed against the whole
+    block and is never marked optimal unless the block fit in a single segment. Every segment
+    search, including the seam re-solves, adds to `stats`.
+    '''
+    if solve is None:
+        solve = exact_or_beam(max_nodes)
+    part = partition(graph.target, max_calls)
+    spans = [(segment.start, segment.stop) for segment in part.segments]
+    schedules: list[Schedule] = []
+    for start, stop in spans:
+        if (schedule := _solve(part, start, stop, config, cost, solve, stats)) is None:
+            return None
+        schedules.append(schedule)
+
+    if improve_seams:
+        i = 0
+        while i + 1 < len(spans):
+            (start, _), (_, stop) = spans[i], spans[i + 1]
+            joint = _solve(part, start, stop, config, cost, solve, stats)
+            if joint is not None and joint.cost < schedules[i].cost + schedules[i + 1].cost:
+                spans[i:i + 2] = [(start, stop)]
+                schedules[i:i + 2] = [joint]
+            i += 1
+
+    problem = SearchProblem(graph, config, cost)
+    call_offsets = [0]
+    for calls in part.stmt_calls:
+        call_offsets.append(call_offsets[-1] + calls)
+    ops: list[Op] = []
+    for (start, stop), schedule in zip(spans, schedules):
+        ops += _remap(schedule.ops, list(problem.fids[call_offsets[start]:call_offsets[stop]]))
+
+    final = problem.replay(ops)
+    assert final is not None and problem.is_goal(final), 'Stitched schedule does not reach the goal'
+    if stats is not None:
+        stats.goal(len(ops))
+    return Schedule(
+        ops,
+        sum(map(problem.cost, ops)),
+        optimal=len(spans) == 1 and schedules[0].optimal,
+        expanded=sum(schedule.expanded for schedule in schedules)
+    )
@@ -0,0 +1,154 @@
+from typing import Callable, Optional, TypeAlias
+from collections import deque
+from functools import cache
+from .state import State
+from .search import SearchProblem, Schedule
+from .ops import Op, Swap, Dup, Pop, Push, Store, Load, Run
+
+# Candidate replacements for a window of ops. A candidate is only used if it is cheaper and leaves
+# the exact same state (stack, locals and progress) as the window it replaces.
+Rewrite: TypeAlias = Callable[[SearchProblem, tuple[Op, ...]], list[list[Op]]]
+
+
+def _drop(problem: SearchProblem, window: tuple[Op, ...]) -> list[list[Op]]:
+    return [[]]
+
+
+def _reload(problem: SearchProblem, window: tuple[Op, ...]) -> list[list[Op]]:
+    store, load = window
+    assert isinstance(store, Store) and isinstance(load, Load)
+    if store.slot != load.slot:
+        return []
+    return [[Dup(1), Store(store.slot)]]
+
+
+def _variants(problem: SearchProblem, window: tuple[Op, ...]) -> list[list[Op]]:
+    '''Equivalent `sub` group forms of the call ending the window, absorbing the SWAP before it.'''
+    run = window[-1]
+    assert isinstance(run, Run)
+    return [[Run(run.fid, name)] for name, _, _ in problem.fn_variants[run.fid]]
+
+
+PATTERNS: dict[tuple[type[Op], ...], list[Rewrite]] = {
+    (Swap, Swap): [_drop],
+    (Dup, Pop): [_drop],
+    (Push, Pop): [_drop],
+    (Load, Pop): [_drop],
+    (Store, Load): [_reload],
+    # a call alone is never swapped for another variant, `Run` costs the same in every variant
+    (Swap, Run): [_variants],
+}
+MAX_WINDOW = max(map(len, PATTERNS))
+
+
+# Runs of SWAPs touching at most this many slots are replaced by a shortest equivalent sequence.
+MAX_PERMUTATION_DEPTH = 6
+
+
+@cache
+def swap_table(size: int) -> dict[tuple[int, ...], tuple[int, ...]]:
+    '''
+    Shortest SWAP depths producing every permutation of the top `size` slots (index 0 is the top),
+    found by a breadth first search from the identity.
+    '''
+    identity = tuple(range(size))
+    table = {identity: ()}
+    queue = deque([identity])
+    while queue:
+        perm = queue.popleft()
+        for depth in range(1, size):
+            nxt = list(perm)
+            nxt[0], nxt[depth] = nxt[depth], nxt[0]
+            if (key := tuple(nxt)) not in table:
+                table[key] = table[perm] + (depth,)
+                queue.append(key)
+    return table
+
+
+def _permute(depths: list[int], size: int) -> tuple[int, ...]:
+    perm = list(range(size))
+    for depth in depths:
+        perm[0], perm[depth] = perm[depth], perm[0]
+    return tuple(perm)
+
+
+def _shorten_swaps(problem: SearchProblem, ops: list[Op], states: list[State]) -> Optional[list[Op]]:
+    i = 0
+    while i < len(ops):
+        j = i
+        while j < len(ops) and isinstance(ops[j], Swap):
+            j += 1
+        if j - i >= 2:
+            depths = [op.depth for op in ops[i:j] if isinstance(op, Swap)]
+            if (size := max(depths) + 1) <= MAX_PERMUTATION_DEPTH:
+                replacement: list[Op] = [Swap(depth) for depth in swap_table(size)[_permute(depths, size)]]
+                if sum(map(problem.cost, replacement)) < sum(map(problem.cost, ops[i:j])) \
+                        and _run_all(problem, states[i], replacement) == states[j]:
+                    return ops[:i] + replacement + ops[j:]
+        i = max(j, i + 1)
+    return None
+
+
+def _states(problem: SearchProblem, ops: list[Op]) -> list[State]:
+    '''The state before every op followed by the final state.'''
+    states = [problem.initial()]
+    for op in ops:
+        state = problem.apply(states[-1], op)
+        assert state is not None, f'Illegal op {op} in schedule'
+        states.append(state)
+    return states
+
+
+def _run_all(problem: SearchProblem, state: State, ops: list[Op]) -> Optional[State]:
+    for op in ops:
+        if (next_state := problem.apply(state, op)) is None:
+            return None
+        state = next_state
+    return state
+
+
+def _drop_cycles(ops: list[Op], states: list[State]) -> Optional[list[Op]]:
+    '''Removes the ops between two visits of the same state, if any.'''
+    seen: dict[State, int] = {}
+    for i, state in enumerate(states):
+        if (first := seen.get(state)) is not None:
+            return ops[:first] + ops[i:]
+        seen[state] = i
+    return None
+
+
+def _rewrite_once(problem: SearchProblem, ops: list[Op], states: list[State]) -> Optional[list[Op]]:
+    cost = problem.cost
+    for i in range(len(ops)):
+        for size in range(1, MAX_WINDOW + 1):
+            window = tuple(ops[i:i + size])
+            if len(window) < size:
+                break
+            window_cost = sum(map(cost, window))
+            for rewrite in PATTERNS.get(tuple(map(type, window)), []):
+                for replacement in rewrite(problem, window):
+                    if sum(map(cost, replacement)) >= window_cost:
+                        continue
+                    if _run_all(problem, states[i], replacement) == states[i + size]:
+                        return ops[:i] + replacement + ops[i + size:]
+    return None
+
+
+def optimize(problem: SearchProblem, schedule: Schedule) -> Schedule:
+    '''
+    Peephole pass over a finished schedule: removes op sequences that return to an earlier state,
+    replaces runs of SWAPs by the shortest equivalent run (`swap_table`) and applies the cheaper
+    `PATTERNS` rewrites until none applies. Every change either drops ops
+    without adding cost or strictly lowers the cost, so this terminates.
+    '''
+    ops = schedule.ops
+    while True:
+        states = _states(problem, ops)
+        if (new_ops := _drop_cycles(ops, states)) is None \
+                and (new_ops := _shorten_swaps(problem, ops, states)) is None \
+                and (new_ops := _rewrite_once(problem, ops, states)) is None:
+            break
+        ops = new_ops
+
+    cost = sum(map(problem.cost, ops))
+    return Schedule(ops, cost, optimal=schedule.optimal, expanded=schedule.expanded)
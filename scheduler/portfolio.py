@@ -0,0 +1,142 @@
+from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+import os
+import time
+from .graph import Graph
+from .symbolic import Config
+from .target import Target
+from .search import SearchProblem, Schedule
+from .heuristic import HEURISTICS
+from .anytime import Strategy, anytime, deadline_from_ms
+from .shared import SharedIncumbent
+from .ops import CostFn
+from .cost import CostModel, INSTRUCTIONS
+from .stats import SearchStats
+
+
+@dataclass(frozen=True)
+class Task:
+    strategy: Strategy
+    heuristic: str = 'default'
+    weight: float = 3.0
+    beam_width: int = 64
+
+
+DEFAULT_PORTFOLIO = [
+    Task('wastar', weight=1.0),
+    Task('wastar', weight=1.5),
+    Task('wastar', weight=3.0),
+    Task('wastar', weight=8.0),
+    Task('beam', beam_width=8),
+    Task('beam', beam_width=64),
+    Task('beam', beam_width=512),
+    Task('wastar', heuristic='calls', weight=2.0),
+]
+
+
+@dataclass
+class WorkerResult:
+    task: Task
+    schedule: Optional[Schedule]
+    proved: bool
+    stats: Optional[SearchStats]
+
+
+_shared: Optional[SharedIncumbent] = None
+
+
+def _init_worker(shared: SharedIncumbent):
+    global _shared
+    _shared = shared
+
+
+def _run_task(
+    target: Target,
+    config: Config,
+    task: Task,
+    deadline: Optional[float],
+    reduce_edges: bool,
+    cost: CostModel | CostFn,
+    stats_sample: Optional[int]
+) -> WorkerResult:
+    '''
+    Runs one portfolio member. A proof (an optimal schedule, or an anytime search that ran out
+    of states to beat the shared incumbent) stops every other worker. With `stats_sample` the
+    search fills a `SearchStats` of its own that is returned with the result.
+    '''
+    shared = _shared
+    assert shared is not None, 'Worker not initialized'
+    # `Graph` is rebuilt per worker rather than pickled: its node sets are deeply cross-linked
+    graph = Graph(target)
+    if reduce_edges:
+        graph.transitive_reduction()
+    problem = SearchProblem(graph, config, cost)
+    deadline_ms = None if deadline is None else max(0, int((deadline - time.monotonic()) * 1000))
+    stats = None if stats_sample is None else SearchStats(stats_sample)
+
+    best: Optional[Schedule] = None
+    proved = False
+    for schedule in anytime(
+        problem, HEURISTICS[task.heuristic], task.strategy,
+        deadline_ms, task.beam_width, task.weight, shared, stats
+    ):
+        shared.offer(schedule.cost)
+        if best is None or schedule.cost < best.cost:
+            best = schedule
+        if schedule.optimal:
+            proved = True
+            break
+    else:
+        proved = not shared.stopped and (deadline is None or time.monotonic() <= deadline)
+
+    if proved:
+        shared.stop()
+    return WorkerResult(task, best, proved, stats)
+
+
+def portfolio(
+    graph: Graph,
+    config: Config,
+    tasks: list[Task] = DEFAULT_PORTFOLIO,
+    deadline_ms: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    reduce_edges: bool = False,
+    cost: CostModel | CostFn = INSTRUCTIONS,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Runs `tasks` in parallel worker processes that prune against a shared incumbent cost and
+    returns the cheapest schedule found. It is marked optimal if any worker proved optimality.
+    The counters of every worker are merged into `stats` as it finishes, `stats.hooks` do not
+    run in the workers.
+    '''
+    shared = SharedIncumbent()
+    deadline = deadline_from_ms(deadline_ms)
+    workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+
+    results: list[WorkerResult] = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(shared,)) as pool:
+        futures = [
+            pool.submit(
+                _run_task, graph.target, config, task, deadline, reduce_edges, cost,
+                None if stats is None else stats.sample_every
+            )
+            for task in tasks
+        ]
+        for future in as_completed(futures):
+            results.append(result := future.result())
+            if result.proved:
+                shared.stop()
+            if stats is not None and result.stats is not None:
+                stats.merge(result.stats)
+
+    schedules = [result.schedule for result in results if result.schedule is not None]
+    if not schedules:
+        return None
+    best = min(schedules, key=lambda schedule: schedule.cost)
+    if stats is not None:
+        stats.goal(len(best.ops))
+    # a proof from any worker covers the global minimum, see `_run_task`
+    best.optimal = any(result.proved for result in results)
+    return best
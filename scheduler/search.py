@@ -0,0 +1,556 @@
+from array import array
+from typing import Callable, Generator, Optional, TypeAlias
+from dataclasses import dataclass
+from heapq import heappush, heappop
+from itertools import count
+import time
+from .graph import Const, CompactGraph, FunctionNode, ValueNode, Graph
+from .state import State, DONE
+from .symbolic import Config, SwapBeyondMaxDepth, DupBeyondMaxDepth, StackTooShallow, MissingLocal
+from .target import FuncSpec
+from .table import Entry, TranspositionTable
+from .shared import SharedIncumbent
+from .stats import SearchStats
+from .ops import Op, Swap, Dup, Pop, Push, Store, Load, Run, CostFn
+from .ops import SWAP, DUP, POP, PUSH, STORE, LOAD, RUN
+from .cost import CostModel, INSTRUCTIONS
+
+
+@dataclass
+class Schedule:
+    ops: list[Op]
+    cost: int
+    optimal: bool
+    expanded: int = 0
+
+    def evm(self) -> list[str]:
+        return [
+            instr
+            for op in self.ops
+            for instr in op.evm()
+        ]
+
+
+class SearchProblem:
+    '''
+    Stack layouts of `main` follow the `SymbolicVM.stack` order (last element on top). Calls to
+    `ext` functions follow EVM operand order: the first stack input is consumed from the top and
+    the first stack output is left on top.
+    '''
+    graph: Graph
+    compact: CompactGraph
+    config: Config
+    cost: CostFn
+    symmetry: bool
+    por: bool
+    commuting_fids: set[int]
+    consuming_fids: set[int]
+    fids: array
+    fns: list[FunctionNode]
+    fn_by_fid: dict[int, FunctionNode]
+    specs: dict[int, FuncSpec]
+    fn_costs: dict[int, int]
+    fn_inputs: dict[int, list[int]]
+    fn_variants: dict[int, list[tuple[str, FuncSpec, list[int]]]]
+    consts: dict[int, int]
+    values: list[ValueNode]
+    slots: list[int]
+    out_stack: array
+    out_locals: list[tuple[int, int]]
+    stack_consumers: list[array]
+    stack_delta: dict[int, int]
+    out_stack_count: dict[int, int]
+    copy_costs: dict[int, int]
+    drop_cost: int
+    reorder_cost: int
+
+    def __init__(
+        self,
+        graph: Graph,
+        config: Config,
+        cost: CostModel | CostFn = INSTRUCTIONS,
+        symmetry: bool = True,
+        por: bool = False
+    ) -> None:
+        if isinstance(cost, CostModel):
+            cost = cost.bind(graph, config)
+        self.graph = graph
+        self.compact = graph.compact
+        self.config = config
+        self.cost = cost
+        self.symmetry = symmetry
+        self.por = por
+
+        self.fids = self.compact.fids
+        self.fns = sorted(graph.fns, key=lambda fn: fn.fid)
+        self.fn_by_fid = {fn.fid: fn for fn in self.fns}
+        self.specs = {
+            fn.fid: graph.specs[fn.calls].spec
+            for fn in self.fns
+        }
+        self.fn_inputs = {
+            fn.fid: [value.vid for value in fn.inputs]
+            for fn in self.fns
+        }
+        self.fn_variants = {}
+        for fn in self.fns:
+            variants = graph.call_variants(fn) if symmetry else [(fn.calls, fn.inputs)]
+            self.fn_variants[fn.fid] = [
+                (name, graph.specs[name].spec, [value.vid for value in inputs])
+                for name, inputs in variants
+            ]
+        self.fn_costs = {
+            fn.fid: min(cost(Run(fn.fid, name)) for name, _, _ in self.fn_variants[fn.fid])
+            for fn in self.fns
+        }
+
+        self.values = sorted(graph.values, key=lambda value: value.vid)
+        self.consts = {
+            value.vid: value.producer.value
+            for value in self.values
+            if isinstance(value.producer, Const)
+        }
+
+        main_def = graph.target.main_def
+        self.out_stack = array('H', (graph.vars[name].vid for name in main_def.out.stack))
+        self.out_locals = [(slot, graph.vars[name].vid) for name, slot in main_def.out.locals]
+
+        used_slots = {
+            slot
+            for layout in (main_def.inp, main_def.out)
+            for _, slot in layout.locals
+        }
+        first_scratch = max(used_slots, default=-1) + 1
+        self.slots = sorted(used_slots) + list(range(first_scratch, first_scratch + config.scratch_slots))
+
+        self.stack_consumers = [array('H') for _ in self.values]
+        self.stack_delta = {}
+        for fn in self.fns:
+            spec = self.specs[fn.fid]
+            for vid in self.fn_inputs[fn.fid][:len(spec.inp.stack)]:
+                self.stack_consumers[vid].append(fn.fid)
+            self.stack_delta[fn.fid] = len(spec.out.stack) - len(spec.inp.stack)
+
+        self.out_stack_count = {value.vid: 0 for value in self.values}
+        for vid in self.out_stack:
+            self.out_stack_count[vid] += 1
+
+        dup_cost = min(
+            (cost(Dup(depth)) for depth in range(1, config.max_dup_depth + 1)),
+            default=None
+        )
+        load_cost = min((cost(Load(slot)) for slot in self.slots), default=None)
+        store_cost = min((cost(Store(slot)) for slot in self.slots), default=None)
+        self.copy_costs = {}
+        for value in self.values:
+            options = [dup_cost, load_cost]
+            if (const := self.consts.get(value.vid)) is not None:
+                options.append(cost(Push(const)))
+            self.copy_costs[value.vid] = min((c for c in options if c is not None), default=0)
+        self.drop_cost = min(c for c in (cost(Pop()), store_cost) if c is not None)
+        swap_cost = min(
+            (cost(Swap(depth)) for depth in range(1, config.max_swap_depth + 1)),
+            default=None
+        )
+        self.reorder_cost = min(
+            c
+            for c in (swap_cost, cost(Pop()), store_cost)
+            if c is not None
+        )
+
+        # calls that leave the stack alone and write no locals in every variant, see `_forced`
+        self.commuting_fids = {
+            fid
+            for fid, variants in self.fn_variants.items()
+            if all(not spec.inp.stack and not spec.out.stack and not spec.out.locals for _, spec, _ in variants)
+        } if por else set()
+        # calls without locals that take stack operands and push at most as many results, see
+        # `_forced`. Without slots no op can park an operand off the stack and bring it back
+        self.consuming_fids = {
+            fid
+            for fid, variants in self.fn_variants.items()
+            if all(
+                not spec.inp.locals and not spec.out.locals and spec.inp.stack
+                and len(spec.out.stack) <= len(spec.inp.stack)
+                for _, spec, _ in variants
+            )
+        } if por and not self.slots else set()
+
+    def initial(self) -> State:
+        return State.from_graph(self.graph, self.config)
+
+    def is_goal(self, state: State) -> bool:
+        pending = state.fn_pending_preds
+        if not all(pending[fid] == DONE for fid in self.fids):
+            return False
+        vm = state.vm
+        if vm.stack != self.out_stack:
+            return False
+        return all(vm.local_get(slot) == vid for slot, vid in self.out_locals)
+
+    def stack_demand(self, state: State, vid: int) -> int:
+        '''Stack copies of value `vid` still to be consumed by calls or left in the output layout.'''
+        pending = state.fn_pending_preds
+        return self.out_stack_count[vid] + sum(
+            1
+            for fid in self.stack_consumers[vid]
+            if pending[fid] != DONE
+        )
+
+    def is_recoverable(self, state: State, vid: int) -> bool:
+        return vid in self.consts or vid in state.vm.locals
+
+    def moves(self, state: State) -> list[Op]:
+        '''The ops worth exploring from `state`, all legal there.'''
+        vm = state.vm
+        stack = vm.stack
+        uses = state.value_remaining_uses
+
+        if self.por and (forced := self._forced(state)) is not None:
+            return [forced]
+
+        ops: list[Op] = [
+            Run(fid, name)
+            for fid in state.ready_fids()
+            if (name := self._runnable(state, fid)) is not None
+        ]
+
+        # PUSH, DUP and load of the same value lead to the same state, only the cheapest (the
+        # first on ties) is explored
+        copies: dict[int, int] = {}
+        for vid, const in self.consts.items():
+            if self.stack_demand(state, vid) > stack.count(vid):
+                copies[vid] = self.cost(op := Push(const))
+                ops.append(op)
+
+        for depth in range(1, min(len(stack), self.config.max_dup_depth) + 1):
+            vid = stack[-depth]
+            op = Dup(depth)
+            if vid in copies and copies[vid] <= self.cost(op):
+                continue
+            if self.stack_demand(state, vid) > stack.count(vid):
+                copies[vid] = self.cost(op)
+                ops.append(op)
+
+        for depth in range(1, min(len(stack) - 1, self.config.max_swap_depth) + 1):
+            if stack[-1] != stack[-depth - 1]:
+                ops.append(Swap(depth))
+
+        if stack:
+            top = stack[-1]
+            if self.stack_demand(state, top) < stack.count(top) or self.is_recoverable(state, top):
+                ops.append(Pop())
+
+            if uses[top] > 0:
+                for slot in self.slots:
+                    if (current := vm.local_get(slot)) == top:
+                        continue
+                    if current is not None and uses[current] > 0 \
+                            and current not in stack and current not in self.consts:
+                        continue
+                    ops.append(Store(slot))
+
+        for slot in self.slots:
+            op = Load(slot)
+            if (vid := vm.local_get(slot)) is not None \
+                    and not (vid in copies and copies[vid] <= self.cost(op)) \
+                    and self.stack_demand(state, vid) > stack.count(vid):
+                copies[vid] = self.cost(op)
+                ops.append(op)
+
+        return ops
+
+    def successors(self, state: State) -> Generator[tuple[Op, State], None, None]:
+        for op in self.moves(state):
+            child = state.copy()
+            self.make(child, op)
+            yield op, child
+
+    def make(self, state: State, op: Op) -> bool:
+        '''
+        Executes `op` on `state` in place, returns False and leaves `state` unchanged if it is not
+        legal there. Roll back with `State.mark` and `State.undo`.
+        '''
+        vm = state.vm
+        kind = op.kind
+        try:
+            if kind == SWAP:
+                vm.swap(op.arg)
+            elif kind == DUP:
+                vm.dup(op.arg)
+            elif kind == RUN:
+                assert isinstance(op, Run)
+                if op.fid not in self.fn_by_fid or state.fn_pending_preds[op.fid] != 0 \
+                        or (match := self._match(state, op.fid, op.name)) is None \
+                        or not self._keeps_inputs(state, op.fid, match[1]):
+                    return False
+                self._execute(state, op.fid, match[1])
+            elif kind == POP:
+                vm.pop()
+            elif kind == STORE:
+                assert isinstance(op, Store)
+                vm.store(op.slot)
+            elif kind == LOAD:
+                assert isinstance(op, Load)
+                vm.load(op.slot)
+            elif kind == PUSH:
+                assert isinstance(op, Push)
+                vid = next((vid for vid, value in self.consts.items() if value == op.value), None)
+                if vid is None:
+                    return False
+                vm.push(vid)
+            else:
+                raise TypeError(f'Unknown op {op}')
+        except (SwapBeyondMaxDepth, DupBeyondMaxDepth, StackTooShallow, MissingLocal):
+            return False
+        return True
+
+    def apply(self, state: State, op: Op) -> Optional[State]:
+        '''Executes `op` on a copy of `state`, returns None if it is not legal there.'''
+        child = state.copy()
+        return child if self.make(child, op) else None
+
+    def replay(self, ops: list[Op]) -> Optional[State]:
+        '''Applies `ops` from the initial state, returns the final state or None if any op is illegal.'''
+        state = self.initial()
+        for op in ops:
+            if not self.make(state, op):
+                return None
+        return state
+
+    def _match(self, state: State, fid: int, only: Optional[str] = None) -> Optional[tuple[str, FuncSpec]]:
+        stack = state.vm.stack
+        for name, spec, inputs in self.fn_variants[fid]:
+            if only is not None and name != only:
+                continue
+            n = len(spec.inp.stack)
+            if len(stack) < n:
+                continue
+            if not all(stack[-1 - i] == inputs[i] for i in range(n)):
+                continue
+            if not all(
+                state.vm.local_get(slot) == vid
+                for (_, slot), vid in zip(spec.inp.locals, inputs[n:])
+            ):
+                continue
+            return name, spec
+        return None
+
+    def _keeps_inputs(self, state: State, fid: int, spec: FuncSpec) -> bool:
+        '''Whether inputs still used after the call stay available, on the stack below its operands or recoverable.'''
+        stack = state.vm.stack
+        uses = state.value_remaining_uses
+        below = len(stack) - len(spec.inp.stack)
+        return all(
+            uses[vid] <= 1 or self.is_recoverable(state, vid) or vid in stack[:below]
+            for vid in set(self.fn_inputs[fid])
+        )
+
+    def _runnable(self, state: State, fid: int) -> Optional[str]:
+        if (match := self._match(state, fid)) is None or not self._keeps_inputs(state, fid, match[1]):
+            return None
+        return match[0]
+
+    def _forced(self, state: State) -> Optional[Run]:
+        '''
+        Partial order reduction: a ready call that some cheapest schedule from `state` runs next,
+        making it the only move worth exploring. Readiness means all effect and data predecessors
+        are done, so the call may move to the front of any schedule. That costs nothing extra for
+        - a call in `commuting_fids`, which commutes with every other op: running it early only
+          lowers use counts and enables successors, which never makes a later op illegal.
+        - a call in `consuming_fids` whose operands are on top of the stack, each the only copy
+          with no other use left. Other ops can only move these operands around until the call;
+          run first, its results take the place of the first operands and the rest are gone. A
+          constant is not allowed in a result position, a schedule may drop and push it again.
+        The lowest fid of either kind is taken.
+        '''
+        stack = state.vm.stack
+        uses = state.value_remaining_uses
+        for fid in state.ready_fids():
+            if fid in self.commuting_fids:
+                if (name := self._runnable(state, fid)) is not None:
+                    return Run(fid, name)
+            elif fid in self.consuming_fids and (match := self._match(state, fid)) is not None:
+                name, spec = match
+                results = len(spec.out.stack)
+                operands = stack[len(stack) - len(spec.inp.stack):]
+                if all(
+                    uses[vid] == 1 and stack.count(vid) == 1
+                    and (i >= results or vid not in self.consts)
+                    for i, vid in enumerate(reversed(operands))
+                ):
+                    return Run(fid, name)
+        return None
+
+    def _execute(self, state: State, fid: int, spec: FuncSpec):
+        vm = state.vm
+        for _ in range(len(spec.inp.stack)):
+            vm.pop()
+        state.complete(fid, self.compact)
+        outputs = self.compact.fn_outputs(fid)
+        m = len(spec.out.stack)
+        for vid in reversed(outputs[:m]):
+            vm.push(vid)
+        for (_, slot), vid in zip(spec.out.locals, outputs[m:]):
+            vm.local_set(slot, vid)
+
+
+Heuristic: TypeAlias = Callable[[SearchProblem, State], int]
+
+
+def _greedy(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    start: Entry,
+    max_nodes: Optional[int] = None,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Greedy best first completion (by h alone) of the path to `start`. It keeps a table of its own:
+    states the caller already generated must stay reachable, or the completion dead-ends on them.
+    The state space is finite, so without `max_nodes` it only fails if no goal is reachable.
+    '''
+    if stats is not None:
+        heuristic = stats.timed(heuristic)
+    table = TranspositionTable()
+    table.put(start)
+    tie = count()
+    frontier = [(heuristic(problem, start.state), next(tie), start)]
+    expanded = 0
+
+    while frontier and (max_nodes is None or expanded < max_nodes):
+        _, _, entry = heappop(frontier)
+        if problem.is_goal(entry.state):
+            ops = entry.path()
+            if stats is not None:
+                stats.goal(len(ops))
+            return Schedule(ops, sum(map(problem.cost, ops)), optimal=False, expanded=expanded)
+        expanded += 1
+        if stats is not None:
+            stats.expand(len(frontier))
+
+        for op, child in problem.successors(entry.state):
+            child_g = entry.g + problem.cost(op)
+            if (known := table.get(child)) is not None:
+                if known.g > child_g:
+                    known.g, known.parent, known.op = child_g, entry, op
+                if stats is not None:
+                    stats.duplicates += 1
+                continue
+            table.put(child_entry := entry.child(child, op, child_g))
+            heappush(frontier, (heuristic(problem, child), next(tie), child_entry))
+            if stats is not None:
+                stats.generated += 1
+
+    return None
+
+
+Frontier: TypeAlias = list[tuple[float, int, int, Entry]]
+
+DEADLINE_CHECK_INTERVAL = 256
+
+
+def best_first(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    table: TranspositionTable,
+    weight: float = 1.0,
+    max_nodes: Optional[int] = None,
+    bound: Optional[int] = None,
+    deadline: Optional[float] = None,
+    shared: Optional[SharedIncumbent] = None,
+    stats: Optional[SearchStats] = None
+) -> tuple[Optional[Schedule], Frontier, int]:
+    '''
+    Weighted A* (f = g + weight * h). Stops at the first goal, once `max_nodes` states were
+    expanded, once `time.monotonic()` passes `deadline` or once `shared` is stopped, returning
+    the goal schedule (if any), the remaining frontier and the expansion count. States that
+    cannot beat `bound` (tightened periodically from `shared`) are pruned.
+    '''
+    if stats is not None:
+        heuristic = stats.timed(heuristic)
+    start = Entry(problem.initial(), 0)
+    table.put(start)
+    tie = count()
+    h = heuristic(problem, start.state)
+    frontier: Frontier = [(weight * h, h, next(tie), start)]
+    expanded = 0
+
+    while frontier:
+        f, h, _, entry = heappop(frontier)
+        if entry.closed:
+            if stats is not None:
+                stats.stale += 1
+            continue
+        if (known := table.get(entry.state)) is None:
+            table.put(entry)
+        elif known is not entry:
+            if known.g <= entry.g:
+                if stats is not None:
+                    stats.stale += 1
+                continue
+            table.put(entry)
+
+        if problem.is_goal(entry.state):
+            schedule = Schedule(entry.path(), entry.g, optimal=weight == 1.0, expanded=expanded)
+            if stats is not None:
+                stats.goal(len(schedule.ops))
+            return schedule, frontier, expanded
+        if max_nodes is not None and expanded >= max_nodes:
+            heappush(frontier, (f, h, next(tie), entry))
+            break
+        if expanded % DEADLINE_CHECK_INTERVAL == 0:
+            if (deadline is not None and time.monotonic() > deadline) \
+                    or (shared is not None and shared.stopped):
+                heappush(frontier, (f, h, next(tie), entry))
+                break
+            if shared is not None:
+                bound = shared.tighten(bound)
+                if bound is not None and entry.g + h >= bound:
+                    continue
+        entry.closed = True
+        expanded += 1
+        if stats is not None:
+            stats.expand(len(frontier))
+
+        for op, child in problem.successors(entry.state):
+            child_g = entry.g + problem.cost(op)
+            if (known := table.get(child)) is not None and known.g <= child_g:
+                if stats is not None:
+                    stats.duplicates += 1
+                continue
+            child_h = heuristic(problem, child)
+            if bound is not None and child_g + child_h >= bound:
+                if stats is not None:
+                    stats.pruned += 1
+                continue
+            table.put(child_entry := entry.child(child, op, child_g))
+            heappush(frontier, (child_g + weight * child_h, child_h, next(tie), child_entry))
+            if stats is not None:
+                stats.generated += 1
+
+    return None, frontier, expanded
+
+
+def astar(
+    problem: SearchProblem,
+    heuristic: Heuristic,
+    max_nodes: int = 100_000,
+    table: Optional[TranspositionTable] = None,
+    stats: Optional[SearchStats] = None
+) -> Optional[Schedule]:
+    '''
+    Returns the cheapest schedule or, if `max_nodes` expansions are exhausted first, the schedule
+    found by greedily completing the most promising frontier node (`_greedy`, not counted against
+    `max_nodes`).
+    '''
+    if table is None:
+        table = TranspositionTable()
+    schedule, frontier, expanded = best_first(problem, heuristic, table, max_nodes=max_nodes, stats=stats)
+    if schedule is not None or not frontier:
+        return schedule
+
+    _, _, _, promising = min(frontier, key=lambda item: (item[1], item[0]))
+    if (schedule := _greedy(problem, heuristic, promising, stats=stats)) is not None:
+        schedule.expanded += expanded
+    return schedule
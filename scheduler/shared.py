@@ -0,0 +1,39 @@
+from typing import Optional
+import multiprocessing
+
+
+class SharedIncumbent:
+    '''
+    Best schedule cost and a stop flag in shared memory, readable by every worker process it
+    was handed to at creation (e.g. through a pool initializer).
+    '''
+    NO_COST = -1
+
+    def __init__(self) -> None:
+        self._cost = multiprocessing.Value('q', self.NO_COST)
+        self._stop = multiprocessing.Value('b', 0)
+
+    @property
+    def cost(self) -> Optional[int]:
+        cost = self._cost.value
+        return None if cost == self.NO_COST else cost
+
+    def offer(self, cost: int) -> bool:
+        '''Records `cost` if it beats the current incumbent, returns whether it did.'''
+        with self._cost.get_lock():
+            if self._cost.value == self.NO_COST or cost < self._cost.value:
+                self._cost.value = cost
+                return True
+            return False
+
+    def tighten(self, bound: Optional[int]) -> Optional[int]:
+        if (cost := self.cost) is None:
+            return bound
+        return cost if bound is None else min(bound, cost)
+
+    @property
+    def stopped(self) -> bool:
+        return bool(self._stop.value)
+
+    def stop(self):
+        self._stop.value = 1
@@ -1,49 +1,195 @@
-from .symbolic import SymbolicVM, Config
-from .graph import FunctionNode, ValueNode, Graph
-from dataclasses import dataclass
+from array import array
+from typing import Generator, Optional
+from operator import sub
+from weakref import WeakKeyDictionary
+from .symbolic import SymbolicVM, Config, MAX_VALUES, UndoEntry
+from .graph import FunctionNode, CompactGraph, Graph
+from dataclasses import dataclass, field
+from . import zobrist
+from .zobrist import PENDING, USES
 
 
-@dataclass
+DONE = -1
+
+# Undo log entry kinds of the counters, after those of `SymbolicVM`.
+UNDO_PENDING, UNDO_USES = 4, 5
+
+
+@dataclass(slots=True)
 class State:
+    '''
+    `ready` is a bitset of the fids whose pending count is 0, derived from `fn_pending_preds` and
+    kept in sync by `set_pending_preds`. Fids of constants are marked `DONE` from the start.
+
+    After `mark` every change to the state and its VM is recorded in `log`, `undo` rolls back to
+    a mark in time proportional to the changes since.
+    '''
     vm: SymbolicVM
-    fn_pending_preds: list[int]
-    value_remaining_uses: list[int]
+    fn_pending_preds: array
+    value_remaining_uses: array
+    counters_hash: Optional[int] = field(default=None, compare=False, repr=False)
+    ready: Optional[int] = field(default=None, compare=False, repr=False)
+    log: Optional[list[UndoEntry]] = field(default=None, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.counters_hash is None:
+            self.counters_hash = self.full_counters_hash()
+        if self.ready is None:
+            self.ready = self.full_ready()
 
     def __hash__(self) -> int:
-        return hash((
-            self.vm,
-            tuple(self.fn_pending_preds),
-            tuple(self.value_remaining_uses)
-        ))
+        if zobrist.CHECK_HASHES:
+            assert self.counters_hash == self.full_counters_hash(), 'Incremental counter hash out of sync'
+        return hash(self.vm) ^ self.counters_hash
 
-    @classmethod
-    def from_graph(cls, graph: Graph, config: Config) -> 'State':
-        vm = SymbolicVM(config)
-        spec = graph.target.main_def
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, State):
+            return NotImplemented
+        return self.counters_hash == other.counters_hash \
+            and self.vm == other.vm \
+            and self.fn_pending_preds == other.fn_pending_preds \
+            and self.value_remaining_uses == other.value_remaining_uses
 
-        vm.stack = [
-            graph.inputs[stack_var]
-            for stack_var in spec.inp.stack
-        ]
-        for var, slot in spec.inp.locals:
-            vm.local_set(slot, graph.inputs[var])
+    def full_counters_hash(self) -> int:
+        h = 0
+        for fid, pending in enumerate(self.fn_pending_preds):
+            h ^= zobrist.key(PENDING, fid, pending)
+        for vid, uses in enumerate(self.value_remaining_uses):
+            h ^= zobrist.key(USES, vid, uses)
+        return h
 
-        fn_pending_preds = [0] * graph.total_fns
-        for fn in graph.fns:
-            fn_pending_preds[fn.fid] = len(fn.preds)
+    def full_ready(self) -> int:
+        ready = 0
+        for fid, pending in enumerate(self.fn_pending_preds):
+            if pending == 0:
+                ready |= 1 << fid
+        return ready
 
-        value_remaining_uses = [0] * graph.total_values
-        for value in graph.values:
-            value_remaining_uses[value.vid] = len(value.consumers) + any(
-                value == graph.vars[out]
-                for out in graph.target.main_def.out.names()
-            )
+    def ready_fids(self) -> Generator[int, None, None]:
+        '''Fids that can run once their inputs are in place, in ascending order.'''
+        if zobrist.CHECK_HASHES:
+            assert self.ready == self.full_ready(), 'Ready set out of sync'
+        ready = self.ready
+        assert ready is not None
+        while ready:
+            low = ready & -ready
+            yield low.bit_length() - 1
+            ready ^= low
 
-        return cls(vm, fn_pending_preds, value_remaining_uses)
+    @classmethod
+    def from_graph(cls, graph: Graph, config: Config) -> 'State':
+        if (template := _templates.get(graph)) is None:
+            template = _templates[graph] = StateTemplate.from_graph(graph)
+        return template.instantiate(config)
 
     def copy(self) -> 'State':
         return State(
             self.vm.copy(),
-            self.fn_pending_preds.copy(),
-            self.value_remaining_uses.copy()
+            self.fn_pending_preds[:],
+            self.value_remaining_uses[:],
+            self.counters_hash,
+            self.ready
         )
+
+    def mark(self) -> int:
+        if self.log is None:
+            self.log = self.vm.log = []
+        return len(self.log)
+
+    def undo(self, mark: int):
+        log = self.log
+        assert log is not None and mark <= len(log)
+        self.log = self.vm.log = None
+        while len(log) > mark:
+            entry = log.pop()
+            if (kind := entry[0]) == UNDO_PENDING:
+                self.set_pending_preds(entry[1], entry[2])
+            elif kind == UNDO_USES:
+                self.set_remaining_uses(entry[1], entry[2])
+            else:
+                self.vm.undo(entry)
+        self.log = self.vm.log = log
+
+    def is_done(self, fn: FunctionNode) -> bool:
+        return self.fn_pending_preds[fn.fid] == DONE
+
+    def is_ready(self, fn: FunctionNode) -> bool:
+        return self.fn_pending_preds[fn.fid] == 0
+
+    def complete(self, fid: int, graph: CompactGraph):
+        assert self.fn_pending_preds[fid] == 0, f'{graph.calls[fid]} ({fid}) not ready'
+        self.set_pending_preds(fid, DONE)
+        for succ in graph.fn_succs(fid):
+            self.set_pending_preds(succ, self.fn_pending_preds[succ] - 1)
+        for vid in set(graph.fn_inputs(fid)):
+            self.set_remaining_uses(vid, self.value_remaining_uses[vid] - 1)
+
+    def set_pending_preds(self, fid: int, pending: int):
+        assert self.counters_hash is not None
+        if self.log is not None:
+            self.log.append((UNDO_PENDING, fid, self.fn_pending_preds[fid]))
+        self.counters_hash ^= zobrist.key(PENDING, fid, self.fn_pending_preds[fid]) \
+            ^ zobrist.key(PENDING, fid, pending)
+        self.fn_pending_preds[fid] = pending
+        assert self.ready is not None
+        if pending == 0:
+            self.ready |= 1 << fid
+        else:
+            self.ready &= ~(1 << fid)
+
+    def set_remaining_uses(self, vid: int, uses: int):
+        assert self.counters_hash is not None
+        if self.log is not None:
+            self.log.append((UNDO_USES, vid, self.value_remaining_uses[vid]))
+        self.counters_hash ^= zobrist.key(USES, vid, self.value_remaining_uses[vid]) \
+            ^ zobrist.key(USES, vid, uses)
+        self.value_remaining_uses[vid] = uses
+
+
+@dataclass(frozen=True, slots=True)
+class StateTemplate:
+    '''Initial state of a graph independent of the `Config`, instantiated by copying.'''
+    vm: SymbolicVM
+    fn_pending_preds: array
+    value_remaining_uses: array
+    counters_hash: int
+    ready: int
+
+    @classmethod
+    def from_graph(cls, graph: Graph) -> 'StateTemplate':
+        assert graph.total_values < MAX_VALUES, f'Too many values: {graph.total_values}'
+
+        vm = SymbolicVM(Config(0, 0))
+        spec = graph.target.main_def
+        for stack_var in spec.inp.stack:
+            vm.push(graph.inputs[stack_var].vid)
+        for var, slot in spec.inp.locals:
+            vm.local_set(slot, graph.inputs[var].vid)
+
+        compact = graph.compact
+        offsets = compact.pred_offsets
+        fn_pending_preds = array('h', [DONE]) * compact.total_fns
+        for fid in compact.fids:
+            fn_pending_preds[fid] = offsets[fid + 1] - offsets[fid]
+        # outputs count as a single use however often they appear in the layout
+        offsets = compact.consumer_offsets
+        value_remaining_uses = array('H', (
+            uses + (outputs > 0)
+            for uses, outputs in zip(map(sub, offsets[1:], offsets[:-1]), compact.output_counts)
+        ))
+
+        state = State(vm, fn_pending_preds, value_remaining_uses)
+        assert state.counters_hash is not None and state.ready is not None
+        return cls(vm, fn_pending_preds, value_remaining_uses, state.counters_hash, state.ready)
+
+    def instantiate(self, config: Config) -> State:
+        return State(
+            self.vm.copy(config),
+            self.fn_pending_preds[:],
+            self.value_remaining_uses[:],
+            self.counters_hash,
+            self.ready
+        )
+
+
+_templates: WeakKeyDictionary[Graph, StateTemplate] = WeakKeyDictionary()
@@ -0,0 +1,172 @@
+from typing import Any, Callable, Generator, Optional, TextIO
+from contextlib import contextmanager
+import json
+import resource
+import sys
+import time
+from .state import State
+
+# `Heuristic` without importing `search`, which depends on this module
+HeuristicFn = Callable[[Any, State], int]
+Hook = Callable[['SearchStats'], None]
+
+
+def _peak_rss_kb() -> int:
+    '''High water mark of the resident set of this process over its whole lifetime, in KiB.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+class SearchStats:
+    '''
+    Counters and timers of a search, filled in by the searches that accept a `stats` argument.
+    Counters are exact, the costlier measurements (heuristic timing, frontier size series, peak
+    memory and calls to `hooks`) only happen every `sample_every` expansions or heuristic calls,
+    heuristic time is extrapolated from the timed calls. `process_peak_rss_kb` is the peak of the
+    whole process (including whatever it did before the search), not of the search alone.
+    '''
+    sample_every: int
+    hooks: list[Hook]
+    expanded: int
+    generated: int
+    duplicates: int
+    stale: int
+    pruned: int
+    heuristic_calls: int
+    heuristic_timed: int
+    heuristic_s: float
+    peak_frontier: int
+    process_peak_rss_kb: int
+    depth: Optional[int]
+    frontier: list[tuple[float, int, int]]
+    timers: dict[str, float]
+    started: float
+
+    def __init__(self, sample_every: int = 1, hooks: Optional[list[Hook]] = None) -> None:
+        assert sample_every > 0
+        self.sample_every = sample_every
+        self.hooks = [] if hooks is None else hooks
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.stale = 0
+        self.pruned = 0
+        self.heuristic_calls = 0
+        self.heuristic_timed = 0
+        self.heuristic_s = 0.0
+        self.peak_frontier = 0
+        self.process_peak_rss_kb = 0
+        self.depth = None
+        self.frontier = []
+        self.timers = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def timer(self, phase: str) -> Generator[None, None, None]:
+        '''Adds the time spent in the block to `timers[phase]`.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[phase] = self.timers.get(phase, 0.0) + time.perf_counter() - start
+
+    def timed(self, heuristic: HeuristicFn) -> HeuristicFn:
+        def timed_heuristic(problem: Any, state: State) -> int:
+            self.heuristic_calls += 1
+            if self.heuristic_calls % self.sample_every:
+                return heuristic(problem, state)
+            start = time.perf_counter()
+            h = heuristic(problem, state)
+            self.heuristic_s += time.perf_counter() - start
+            self.heuristic_timed += 1
+            return h
+        return timed_heuristic
+
+    def expand(self, frontier_size: int):
+        self.expanded += 1
+        if frontier_size > self.peak_frontier:
+            self.peak_frontier = frontier_size
+        if self.expanded % self.sample_every == 0:
+            self.sample(frontier_size)
+
+    def sample(self, frontier_size: int):
+        self.frontier.append((round(time.perf_counter() - self.started, 6), self.expanded, frontier_size))
+        self.process_peak_rss_kb = max(self.process_peak_rss_kb, _peak_rss_kb())
+        for hook in self.hooks:
+            hook(self)
+
+    def goal(self, depth: int):
+        self.depth = depth
+
+    def merge(self, other: 'SearchStats'):
+        '''
+        Adds the counters of a search that ran separately (a segment or another worker process),
+        peaks are the maximum of both. Its frontier series and timers are not carried over.
+        '''
+        self.expanded += other.expanded
+        self.generated += other.generated
+        self.duplicates += other.duplicates
+        self.stale += other.stale
+        self.pruned += other.pruned
+        self.heuristic_calls += other.heuristic_calls
+        self.heuristic_timed += other.heuristic_timed
+        self.heuristic_s += other.heuristic_s
+        self.peak_frontier = max(self.peak_frontier, other.peak_frontier)
+        self.process_peak_rss_kb = max(self.process_peak_rss_kb, other.process_peak_rss_kb)
+
+    def elapsed(self) -> float:
+        return self.timers.get('search', time.perf_counter() - self.started)
+
+    def heuristic_time(self) -> float:
+        if self.heuristic_timed == 0:
+            return 0.0
+        return self.heuristic_s * self.heuristic_calls / self.heuristic_timed
+
+    def branching_factor(self) -> Optional[float]:
+        '''
+        Effective branching factor: the `b` for which a uniform tree as deep as the schedule
+        generates as many nodes, `generated = b + b^2 + ... + b^depth`.
+        '''
+        if not self.depth or not self.generated:
+            return None
+        n, d = self.generated, self.depth
+
+        def nodes(b: float) -> float:
+            return d if b == 1 else b * (b ** d - 1) / (b - 1)
+
+        low, high = 0.0, float(max(n, 1))
+        for _ in range(64):
+            mid = (low + high) / 2
+            if nodes(mid) < n:
+                low = mid
+            else:
+                high = mid
+        return round(high, 4)
+
+    def to_json(self) -> dict[str, Any]:
+        elapsed = max(self.elapsed(), 1e-9)
+        self.process_peak_rss_kb = max(self.process_peak_rss_kb, _peak_rss_kb())
+        return {
+            'expanded': self.expanded,
+            'generated': self.generated,
+            'expanded_per_s': round(self.expanded / elapsed, 1),
+            'generated_per_s': round(self.generated / elapsed, 1),
+            'duplicates': self.duplicates,
+            'stale': self.stale,
+            'pruned': self.pruned,
+            'branching_factor': self.branching_factor(),
+            'depth': self.depth,
+            'heuristic_calls': self.heuristic_calls,
+            'heuristic_ms': round(self.heuristic_time() * 1000, 3),
+            'peak_frontier': self.peak_frontier,
+            'process_peak_rss_kb': self.process_peak_rss_kb,
+            'sample_every': self.sample_every,
+            'timers_ms': {phase: round(s * 1000, 3) for phase, s in self.timers.items()},
+            'frontier': self.frontier,
+        }
+
+    def write(self, stream: TextIO, **extra: Any):
+        '''Appends the stats as a single JSON line, with `extra` fields first.'''
+        stream.write(json.dumps({**extra, **self.to_json()}) + '\n')
+        stream.flush()
@@ -1,6 +1,18 @@
+from array import array
 from dataclasses import dataclass
-from typing import Optional, Self
-from .graph import ValueNode
+from typing import Optional, Self, TypeAlias
+from . import zobrist
+from .zobrist import STACK, LOCAL
+
+
+# Stack and locals hold value ids (`ValueNode.vid`), EMPTY marks an unset local.
+EMPTY = 0xFFFF
+MAX_VALUES = EMPTY
+
+# Undo log entry kinds, an entry is a tuple starting with its kind (see `SymbolicVM.log`).
+UNDO_PUSH, UNDO_POP, UNDO_SWAP, UNDO_LOCAL = range(4)
+
+UndoEntry: TypeAlias = tuple[int, ...]
 
 
 class SwapBeyondMaxDepth(Exception):
@@ -19,55 +31,88 @@ class MissingLocal(Exception):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Config:
     max_dup_depth: int
     max_swap_depth: int
+    scratch_slots: int = 0
 
 
 class SymbolicVM:
-    stack: list[ValueNode]
-    locals: list[Optional[ValueNode]]
+    '''
+    While `log` is set every change appends an entry to it, `undo` reverts entries newest first.
+    Copies start without a log.
+    '''
+    __slots__ = ('stack', 'locals', 'zhash', 'log', '__config')
+
+    stack: array
+    locals: array
+    zhash: int
+    log: Optional[list[UndoEntry]]
     __config: Config
 
     def __init__(self, config: Config) -> None:
-        self.stack = []
-        self.locals = []
+        self.stack = array('H')
+        self.locals = array('H')
+        self.zhash = 0
+        self.log = None
         self.__config = config
 
     def __hash__(self) -> int:
-        assert self.locals[-1] is not None
-        return hash((
-            tuple(self.stack),
-            tuple(self.locals)
-        ))
+        if zobrist.CHECK_HASHES:
+            assert self.zhash == self.full_hash(), 'Incremental VM hash out of sync'
+        return self.zhash
+
+    def full_hash(self) -> int:
+        assert not self.locals or self.locals[-1] != EMPTY
+        h = 0
+        for i, vid in enumerate(self.stack):
+            h ^= zobrist.key(STACK, i, vid)
+        for i, vid in enumerate(self.locals):
+            if vid != EMPTY:
+                h ^= zobrist.key(LOCAL, i, vid)
+        return h
 
     @property
     def config(self) -> Config:
         return self.__config
 
-    def pop(self) -> ValueNode:
+    def pop(self) -> int:
         if self.stack:
-            return self.stack.pop()
+            vid = self.stack.pop()
+            self.zhash ^= zobrist.key(STACK, len(self.stack), vid)
+            if self.log is not None:
+                self.log.append((UNDO_POP, vid))
+            return vid
         raise StackTooShallow('Cannot pop from empty stack')
 
-    def push(self, node: ValueNode):
-        self.stack.append(node)
+    def push(self, vid: int):
+        self.zhash ^= zobrist.key(STACK, len(self.stack), vid)
+        self.stack.append(vid)
+        if self.log is not None:
+            self.log.append((UNDO_PUSH,))
 
     def swap(self, depth: int):
         if depth <= 0 or depth > self.config.max_swap_depth:
             raise SwapBeyondMaxDepth(
                 f'swap{depth} invalid, max_swap_depth: {self.config.max_swap_depth}'
             )
-        if depth > len(self.stack) + 1:
+        if depth >= len(self.stack):
             raise StackTooShallow(
                 f'Attempting swap{depth}, stack depth: {len(self.stack)}'
             )
-        ni = -depth - 1
-        self.stack[ni], self.stack[-1] = self.stack[-1], self.stack[ni]
+        stack = self.stack
+        top = len(stack) - 1
+        ni = top - depth
+        a, b = stack[ni], stack[top]
+        self.zhash ^= zobrist.key(STACK, ni, a) ^ zobrist.key(STACK, top, b) \
+            ^ zobrist.key(STACK, ni, b) ^ zobrist.key(STACK, top, a)
+        stack[ni], stack[top] = b, a
+        if self.log is not None:
+            self.log.append((UNDO_SWAP, depth))
 
     def dup(self, depth: int):
-        if depth <= 0 or depth > self.config.max_swap_depth:
+        if depth <= 0 or depth > self.config.max_dup_depth:
             raise DupBeyondMaxDepth(
                 f'dup{depth} invalid, max_dup_depth: {self.config.max_dup_depth}'
             )
@@ -77,14 +122,20 @@ class SymbolicVM:
             )
         self.push(self.stack[-depth])
 
-    def local_get(self, i: int) -> Optional[ValueNode]:
-        if i >= len(self.locals):
+    def local_get(self, i: int) -> Optional[int]:
+        if i >= len(self.locals) or (vid := self.locals[i]) == EMPTY:
             return None
-        return self.locals[i]
+        return vid
 
-    def local_set(self, i: int, value: ValueNode):
-        self.locals.extend([None] * (i - len(self.locals) + 1))
-        self.locals[i] = value
+    def local_set(self, i: int, vid: int):
+        if self.log is not None:
+            self.log.append((UNDO_LOCAL, i, self.locals[i] if i < len(self.locals) else EMPTY, len(self.locals)))
+        if i >= len(self.locals):
+            self.locals.extend([EMPTY] * (i - len(self.locals) + 1))
+        if (old := self.locals[i]) != EMPTY:
+            self.zhash ^= zobrist.key(LOCAL, i, old)
+        self.zhash ^= zobrist.key(LOCAL, i, vid)
+        self.locals[i] = vid
 
     def store(self, i: int):
         self.local_set(i, self.pop())
@@ -94,10 +145,31 @@ class SymbolicVM:
             raise MissingLocal(f'No local[{i}]')
         self.push(local)
 
-    def copy(self) -> 'SymbolicVM':
-        new_vm = SymbolicVM(self.config)
-        new_vm.stack = self.stack.copy()
-        new_vm.locals = self.locals.copy()
+    def undo(self, entry: UndoEntry):
+        '''Reverts a single entry of `log`, must not be called while logging.'''
+        kind = entry[0]
+        if kind == UNDO_PUSH:
+            self.pop()
+        elif kind == UNDO_POP:
+            self.push(entry[1])
+        elif kind == UNDO_SWAP:
+            self.swap(entry[1])
+        else:
+            _, i, old, length = entry
+            if (vid := self.locals[i]) != EMPTY:
+                self.zhash ^= zobrist.key(LOCAL, i, vid)
+            if old != EMPTY:
+                self.zhash ^= zobrist.key(LOCAL, i, old)
+            self.locals[i] = old
+            del self.locals[length:]
+
+    def copy(self, config: Optional[Config] = None) -> 'SymbolicVM':
+        new_vm = SymbolicVM.__new__(SymbolicVM)
+        new_vm.stack = self.stack[:]
+        new_vm.locals = self.locals[:]
+        new_vm.zhash = self.zhash
+        new_vm.log = None
+        new_vm.__config = self.__config if config is None else config
         return new_vm
 
     def __eq__(self, other: object) -> bool:
@@ -105,4 +177,4 @@ class SymbolicVM:
             raise NotImplementedError(
                 f'Comparison not supported between {self.__class__.__name__} and {other}'
             )
-        return self.stack == other.stack and self.locals == other.locals
+        return self.zhash == other.zhash and self.stack == other.stack and self.locals == other.locals
@@ -0,0 +1,132 @@
+from typing import Generator, Literal, Optional, TypeAlias
+from dataclasses import dataclass, field
+from .state import State
+from .ops import Op
+
+
+@dataclass(slots=True, eq=False)
+class Entry:
+    '''
+    Best known path to `state`. Entries double as search nodes: the `parent` chain stays alive
+    through references even after the parent itself is evicted from the table. Closed entries
+    that leave the table `release` their state, so the chain only costs a few fields per op.
+    '''
+    state: State
+    g: int
+    parent: Optional['Entry'] = None
+    op: Optional[Op] = None
+    depth: int = 0
+    closed: bool = False
+
+    def child(self, state: State, op: Op, g: int) -> 'Entry':
+        return Entry(state, g, self, op, self.depth + 1)
+
+    def release(self):
+        '''Drops the state of a closed entry, it can be rebuilt by replaying `path()`.'''
+        self.state = None  # type: ignore[assignment]
+
+    def path(self) -> list[Op]:
+        ops: list[Op] = []
+        entry = self
+        while entry.parent is not None:
+            assert entry.op is not None
+            ops.append(entry.op)
+            entry = entry.parent
+        ops.reverse()
+        return ops
+
+
+Policy: TypeAlias = Literal['depth', 'lru']
+
+
+class TranspositionTable:
+    '''
+    Fixed capacity table of `Entry`s keyed by the state hash and split into buckets of
+    `bucket_size` entries. When a bucket is full the `depth` policy replaces its shallowest entry
+    (the cheapest one to rediscover) and the `lru` policy its least recently used one.
+
+    The capacity bounds the states held for closed nodes: closed entries that are evicted or
+    replaced release their state. Memory is therefore `capacity` states, plus one state per open
+    node (the frontier is only bounded by `bounded.memory_bounded`), plus a state-less `Entry`
+    per ancestor of an open node.
+    '''
+    capacity: int
+    policy: Policy
+    bucket_size: int
+    n_buckets: int
+    buckets: dict[int, list[Entry]]
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+
+    def __init__(self, capacity: int = 1 << 20, policy: Policy = 'depth', bucket_size: int = 4) -> None:
+        assert policy in ('depth', 'lru'), f'Unknown replacement policy {policy!r}'
+        assert capacity >= bucket_size > 0
+        self.capacity = capacity
+        self.policy = policy
+        self.bucket_size = bucket_size
+        self.n_buckets = capacity // bucket_size
+        self.buckets = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self) -> Generator[Entry, None, None]:
+        for bucket in self.buckets.values():
+            yield from bucket
+
+    def get(self, state: State) -> Optional[Entry]:
+        bucket = self.buckets.get(hash(state) % self.n_buckets, [])
+        for i, entry in enumerate(bucket):
+            if entry.state == state:
+                self.hits += 1
+                if self.policy == 'lru':
+                    bucket.append(bucket.pop(i))
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, entry: Entry):
+        '''Inserts `entry`, replacing any existing entry for the same state.'''
+        if (bucket := self.buckets.get(index := hash(entry.state) % self.n_buckets)) is None:
+            bucket = self.buckets[index] = []
+        for i, existing in enumerate(bucket):
+            if existing.state == entry.state:
+                bucket.pop(i)
+                bucket.append(entry)
+                if existing.closed and existing is not entry:
+                    existing.release()
+                return
+
+        if len(bucket) >= self.bucket_size:
+            if self.policy == 'lru':
+                evicted = bucket.pop(0)
+            else:
+                bucket.remove(evicted := min(bucket, key=lambda e: e.depth))
+            if evicted.closed:
+                evicted.release()
+            self.evictions += 1
+            self.size -= 1
+
+        bucket.append(entry)
+        self.size += 1
+
+    def discard(self, entry: Entry):
+        '''Removes `entry` if it is still the entry for its state.'''
+        if (bucket := self.buckets.get(hash(entry.state) % self.n_buckets)) is not None and entry in bucket:
+            bucket.remove(entry)
+            self.size -= 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'size': self.size,
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
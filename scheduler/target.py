@@ -75,6 +75,21 @@ class MultiAssign:
 Statement: TypeAlias = Call | SingleAssign | MultiAssign
 
 
+@define
+class Prelude:
+    defs: list[NamedSpec]
+    sub_groups: list[list[Substitution]]
+
+    def validate(self):
+        unique_names: set[str] = set()
+        for d in self.defs:
+            d.spec.validate()
+            if d.name in unique_names:
+                raise ValueError(f'Duplicate function with name {d.name!r}')
+            unique_names.add(d.name)
+        return self
+
+
 @define
 class Target:
     defs: list[NamedSpec]
@@ -0,0 +1,23 @@
+import os
+from functools import cache
+
+MASK = (1 << 64) - 1
+
+# Recompute the full hash on every `__hash__` call and compare it against the incrementally
+# maintained one. Slow, only meant for debugging.
+CHECK_HASHES = os.environ.get('SCHEDULER_CHECK_HASHES', '') not in ('', '0')
+
+STACK = 0
+LOCAL = 1
+PENDING = 2
+USES = 3
+
+
+@cache
+def key(kind: int, index: int, value: int) -> int:
+    # splitmix64 finalizer over the packed (kind, index, value) triple
+    z = ((kind << 60) | ((index & 0x3FFFFFFF) << 30) | (value & 0x3FFFFFFF)) + 0x9E3779B97F4A7C15
+    z &= MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+    return z ^ (z >> 31)
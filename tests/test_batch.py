@@ -0,0 +1,37 @@
+import os
+import pytest
+from scheduler import batch
+from scheduler.batch import BatchOptions, BlockSource, compile_batch
+
+SOURCE = '''
+main [
+    in: [x]
+    out: [y]
+]
+y = sub(x, 1)
+'''
+
+compile_block = batch.compile_block
+
+
+def crash_on_marked_block(block: BlockSource, options: BatchOptions) -> batch.BlockResult:
+    if block.name == 'crash':
+        os._exit(1)
+    return compile_block(block, options)
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 4])
+def test_worker_crash_only_fails_its_block(monkeypatch: pytest.MonkeyPatch, chunksize: int):
+    # workers are forked, so they see the patched `compile_block`
+    monkeypatch.setattr(batch, 'compile_block', crash_on_marked_block)
+    names = [f'b{i}' for i in range(31)]
+    names[5] = 'crash'
+    results = list(compile_batch(
+        (BlockSource(name, SOURCE) for name in names), max_workers=2, chunksize=chunksize
+    ))
+    assert [result.name for result in results] == names
+    for result in results:
+        if result.name == 'crash':
+            assert result.error is not None and 'BrokenProcessPool' in result.error
+        else:
+            assert result.error is None and result.schedule is not None
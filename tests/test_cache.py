@@ -0,0 +1,55 @@
+from scheduler.parser import parse_to_target
+from scheduler.graph import Graph
+from scheduler.state import Config
+from scheduler.search import SearchProblem
+from scheduler.cache import graph_key
+
+SOURCE = '''
+main [
+    in: [a, b, c, d, e, f, g]
+    out: [p, q]
+]
+x = add(a, b)
+y = mul(c, d)
+p = sub(x, e)
+q = iszero(y)
+sstore(f, g)
+'''
+
+RENAMED_AND_REORDERED = '''
+main [
+    in: [a1, b1, c1, d1, e1, f1, g1]
+    out: [out0, out1]
+]
+sstore(f1, g1)
+v = mul(c1, d1)
+out1 = iszero(v)
+u = add(a1, b1)
+out0 = sub(u, e1)
+'''
+
+SWAPPED_OUTPUTS = '''
+main [
+    in: [a, b, c, d, e, f, g]
+    out: [q, p]
+]
+x = add(a, b)
+y = mul(c, d)
+p = sub(x, e)
+q = iszero(y)
+sstore(f, g)
+'''
+
+
+def key(source: str) -> str:
+    result = graph_key(SearchProblem(Graph(parse_to_target(source)), Config(16, 16)))
+    assert result is not None
+    return result[0]
+
+
+def test_key_ignores_names_and_statement_order():
+    assert key(SOURCE) == key(RENAMED_AND_REORDERED)
+
+
+def test_key_tells_output_order_apart():
+    assert key(SOURCE) != key(SWAPPED_OUTPUTS)
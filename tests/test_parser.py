@@ -0,0 +1,51 @@
+import pytest
+from scheduler.evm import EVM_EXT
+from scheduler.parser import BlockError, builtin_prelude, parse_blocks, split_sources
+from scheduler.target import Prelude
+
+BLOCK = '''
+main [
+    in: [x]
+    out: [y]
+]
+y = sub(x, 1)
+'''
+
+
+def lines(source: str) -> list[str]:
+    return source.splitlines(keepends=True)
+
+
+def test_split_evm_ext():
+    blocks = list(split_sources(lines(EVM_EXT)))
+    prelude = builtin_prelude()
+    exts = [block for block in blocks if block.kind == 'ext']
+    assert [block.source.split()[1] for block in exts] == [d.name for d in prelude.defs]
+    assert sum(block.kind == 'sub' for block in blocks) == len(prelude.sub_groups)
+    sub = next(block for block in exts if block.source.split()[1] == 'sub')
+    assert EVM_EXT.splitlines()[sub.line - 1] == 'ext sub ['
+    assert EVM_EXT[sub.offset:].startswith('ext sub [')
+
+
+def test_parse_blocks_after_evm_ext():
+    blocks = list(parse_blocks(lines(EVM_EXT + BLOCK + BLOCK), Prelude([], [])))
+    assert len(blocks) == 2
+    assert blocks[1].line == EVM_EXT.count('\n') + BLOCK.count('\n') + 2
+    assert {d.name for d in blocks[0].target.defs} == {d.name for d in builtin_prelude().defs}
+
+
+def test_error_position():
+    source = BLOCK + BLOCK.replace('y = sub(x, 1)', 'y = sub(x, 1) )')
+    with pytest.raises(BlockError) as info:
+        list(parse_blocks(lines(source)))
+    assert (info.value.line, info.value.column) == (12, 15)
+    assert source[info.value.offset] == ')'
+
+
+def test_malformed_stream():
+    with pytest.raises(BlockError) as info:
+        list(split_sources(lines('x = 1\n' + BLOCK)))
+    assert (info.value.line, info.value.column, info.value.offset) == (1, 1, 0)
+    with pytest.raises(BlockError) as info:
+        list(split_sources(lines(BLOCK + '] [\n')))
+    assert (info.value.line, info.value.column) == (7, 1)
@@ -0,0 +1,85 @@
+import pytest
+from scheduler.parser import parse_to_target
+from scheduler.graph import Graph
+from scheduler.state import Config
+from scheduler.search import SearchProblem, Schedule, astar
+from scheduler.bounded import ida_star, memory_bounded
+from scheduler.heuristic import DEFAULT
+
+PARALLEL = '''
+main [
+    in: [a, b, c, d, e, f]
+    out: [z, y, x]
+]
+x = add(a, b)
+y = mul(c, d)
+z = sub(e, f)
+'''
+
+MIXED = '''
+main [
+    in: [a, b, c, d, e, f, g]
+    out: [p, q]
+]
+x = add(a, b)
+y = mul(c, d)
+p = sub(x, e)
+q = iszero(y)
+sstore(f, g)
+'''
+
+CONSTANTS = '''
+main [
+    in: [a, b]
+    out: [y, x]
+]
+x = add(a, 1)
+y = shl(2, b)
+mstore(0, x)
+'''
+
+
+@pytest.mark.parametrize('source', [PARALLEL, MIXED, CONSTANTS])
+def test_por_keeps_optimal_cost(source: str):
+    plain, reduced = (
+        astar(SearchProblem(Graph(parse_to_target(source)), Config(16, 16), por=por), DEFAULT)
+        for por in (False, True)
+    )
+    assert plain is not None and reduced is not None
+    assert plain.optimal and reduced.optimal
+    assert reduced.cost == plain.cost
+    assert reduced.expanded <= plain.expanded
+
+
+def test_por_skips_interleavings():
+    plain, reduced = (
+        astar(SearchProblem(Graph(parse_to_target(PARALLEL)), Config(16, 16), por=por), DEFAULT)
+        for por in (False, True)
+    )
+    assert reduced.expanded < plain.expanded
+
+
+BUDGETED = {
+    'astar': lambda problem: astar(problem, DEFAULT, max_nodes=3),
+    'idastar': lambda problem: ida_star(problem, DEFAULT, max_nodes=3),
+    'bounded': lambda problem: memory_bounded(problem, DEFAULT, max_nodes=3),
+}
+
+
+@pytest.mark.parametrize('strategy', BUDGETED)
+def test_exhausted_budget_completes_incumbent(strategy: str):
+    problem = SearchProblem(Graph(parse_to_target(MIXED)), Config(16, 16))
+    schedule: Schedule = BUDGETED[strategy](problem)
+    assert schedule is not None and not schedule.optimal
+    assert (state := problem.replay(schedule.ops)) is not None and problem.is_goal(state)
+    assert schedule.cost == sum(map(problem.cost, schedule.ops))
+    assert schedule.cost >= astar(problem, DEFAULT).cost
+
+
+@pytest.mark.parametrize('source', [PARALLEL, MIXED, CONSTANTS])
+def test_memory_bounded_small_frontier_stays_optimal(source: str):
+    problem = SearchProblem(Graph(parse_to_target(source)), Config(16, 16))
+    optimal = astar(problem, DEFAULT)
+    bounded = memory_bounded(problem, DEFAULT, max_frontier=2, max_nodes=10 * optimal.expanded)
+    assert bounded is not None and bounded.optimal
+    assert bounded.cost == optimal.cost
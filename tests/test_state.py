@@ -0,0 +1,44 @@
+import random
+from scheduler.parser import parse_to_target
+from scheduler.graph import Graph
+from scheduler.state import Config, State
+from scheduler.search import SearchProblem
+
+SOURCE = '''
+main [
+    in: [a, b, c, d]
+    out: [q, p]
+]
+x = add(a, b)
+y = mul(x, c)
+p = sub(y, d)
+q = iszero(x)
+sstore(a, y)
+'''
+
+
+def assert_consistent(state: State, expected: State):
+    assert state == expected
+    assert hash(state) == hash(expected)
+    assert state.counters_hash == state.full_counters_hash()
+    assert state.ready == state.full_ready()
+
+
+def test_undo_restores_state_and_hash():
+    problem = SearchProblem(Graph(parse_to_target(SOURCE)), Config(16, 16))
+    rng = random.Random(0)
+    for _ in range(20):
+        state = problem.initial()
+        trail: list[tuple[int, State]] = []
+        while (moves := problem.moves(state)) and len(trail) < 30:
+            mark = state.mark()
+            trail.append((mark, state.copy()))
+            assert problem.make(state, rng.choice(moves))
+            # the incrementally maintained hash matches a copy built from scratch
+            assert_consistent(state, State(state.vm.copy(), state.fn_pending_preds[:], state.value_remaining_uses[:]))
+        while trail:
+            # undoing to a mark also rolls back every later one
+            mark, before = trail[i := rng.randrange(len(trail))]
+            del trail[i:]
+            state.undo(mark)
+            assert_consistent(state, before)